@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmarks profile discovery, extraction and per-artifact export against
+synthetic profiles (see synthetic.py), reporting rows/sec, peak RSS and
+bytes written for every stage. Each stage runs in a fresh process so its
+peak RSS isn't inflated by the stages before it.
+
+	python3 benchmarks/run.py -n 10000 100000 1000000 -f csv jsonl --json results.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import synthetic
+from tools.stats import format_bytes
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# (browser, artifact) pairs exported by browserintel; Chrome cookies aren't:
+ARTIFACTS = [('chrome', 'history'), ('chrome', 'logins'), ('mozilla', 'history'), ('mozilla', 'cookies'), ('mozilla', 'logins')]
+
+
+def get_peak_rss() -> int:
+	"""
+	Peak resident set size in bytes of this process and of its finished
+	worker processes, whichever is larger (0 where it isn't available):
+	"""
+	if resource is None:
+		return 0
+	peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+	# ru_maxrss is in KiB on Linux but in bytes on macOS:
+	return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_bytes_written(directory) -> int:
+	return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.'))
+
+
+def stage(name, rows, elapsed, bytes_written=0, **extra) -> dict:
+	return {
+		'stage': name,
+		'rows': rows,
+		'seconds': round(elapsed, 4),
+		'rows_per_sec': int(rows / elapsed) if elapsed > 0 else 0,
+		'bytes_written': bytes_written,
+		'peak_rss': get_peak_rss(),
+		**extra,
+	}
+
+
+def get_stages(formats: list) -> list:
+	"""
+	The stages of one benchmark, in report order, as (kind, options) pairs:
+	"""
+	stages = [('discovery', {}), ('manifest', {})]
+	stages += [('extraction', {'fmt': fmt}) for fmt in formats]
+	stages += [('export', {'fmt': fmt, 'browser': browser, 'artifact': artifact}) for fmt in formats for browser, artifact in ARTIFACTS]
+	return stages
+
+
+def run_stage(root, params: dict, work_dir, kind, fmt=None, browser=None, artifact=None, jobs=1, compress=None, compress_thread=False) -> dict:
+	"""
+	Runs one stage against one synthetic data set and returns its result.
+	Called in a fresh process, where browserintel is imported, so the peak
+	RSS it reports belongs to this stage alone. Stages share work_dir, where
+	discovery caches its manifest:
+	"""
+	import browserintel
+	from tools.export import export_rows
+	from tools.xplat import Info
+
+	counts = params['counts']
+	profiles = params['profiles']
+	directories = [synthetic.get_chrome_root(root), synthetic.get_firefox_root(root)]
+	info = Info()
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		if kind == 'discovery':
+			start = time.perf_counter()
+			found = info.get_profiles(directories=directories)
+			return stage('discovery', sum(len(v) for v in found.values()), time.perf_counter() - start)
+		# Written by the first stage to get here, outside of any timing:
+		found = browserintel.discover_profiles(info, directories, work_dir)
+		if kind == 'manifest':
+			start = time.perf_counter()
+			found = browserintel.discover_profiles(info, directories, work_dir)
+			return stage('discovery (manifest)', sum(len(v) for v in found.values()), time.perf_counter() - start)
+
+		if kind == 'extraction':
+			loot_dir = os.path.join(work_dir, f"extract-{fmt}")
+			os.makedirs(loot_dir)
+			rows = 2 * profiles * counts['history'] + profiles * counts['cookies'] + 2 * profiles * counts['logins']
+			start = time.perf_counter()
+			browserintel.get_data([(loot_dir, found)], history=True, cookies=True, logins=True, jobs=jobs, fmt=fmt, compress=compress, compress_thread=compress_thread)
+			return stage('extraction', rows, time.perf_counter() - start, get_bytes_written(loot_dir), format=fmt, jobs=jobs, compress=compress)
+
+		loot_dir = os.path.join(work_dir, f"export-{fmt}-{browser}-{artifact}")
+		os.makedirs(loot_dir)
+		rows = 0
+		start = time.perf_counter()
+		for profile in found[browser]:
+			output_file = os.path.join(loot_dir, f"{os.path.basename(profile)}_{artifact}.{fmt}")
+			if browser == 'mozilla' and artifact == 'logins':
+				rows += export_rows(output_file, browserintel.MOZILLA_LOGIN_HEADERS, browserintel.iter_mozilla_logins(profile), fmt=fmt, compress=compress, threaded=compress_thread).rows
+				continue
+			databases = browserintel.db.Connections(readonly=True)
+			try:
+				conn = browserintel.get_profile_database(databases, profile, browserintel.ARTIFACT_DATABASES[(browser, artifact)], os.path.basename(profile), loot_dir)
+				rows += browserintel.write_query(conn, output_file, browserintel.ARTIFACT_QUERIES[(browser, artifact)], fmt=fmt, compress=compress, compress_thread=compress_thread).rows
+			finally:
+				databases.close()
+		return stage(f"export {browser} {artifact}", rows, time.perf_counter() - start, get_bytes_written(loot_dir), format=fmt, compress=compress)
+
+
+def run_fresh(function, *args, **kwargs):
+	"""
+	Calls function in a fresh interpreter and returns its result. It's run
+	through a ProcessPoolExecutor, since multiprocessing.Pool's daemonic
+	workers can't start the -j pool:
+	"""
+	with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+		return executor.submit(function, *args, **kwargs).result()
+
+
+def run_case(root, params: dict, formats: list, jobs: int, compress=None, compress_thread=False) -> list:
+	"""
+	Runs every stage against one synthetic data set, each in a fresh
+	interpreter since ru_maxrss only ever grows over a process's lifetime:
+	"""
+	work_dir = tempfile.mkdtemp(prefix='browserintel-bench-')
+	try:
+		return [run_fresh(run_stage, root, params, work_dir, kind, jobs=jobs, compress=compress, compress_thread=compress_thread, **stage_options) for kind, stage_options in get_stages(formats)]
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_results(visits: int, results: list):
+	print(f"\n{visits} visits per profile:")
+	print(f"  {'stage':<26} {'format':<8} {'rows':>10} {'seconds':>9} {'rows/sec':>10} {'written':>11} {'peak RSS':>11}")
+	for result in results:
+		print(f"  {result['stage']:<26} {result.get('format', ''):<8} {result['rows']:>10} {result['seconds']:>9.3f} {result['rows_per_sec']:>10} {format_bytes(result['bytes_written']):>11} {format_bytes(result['peak_rss']):>11}")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark browserintel against synthetic browser profiles')
+	parser.add_argument('-n', '--visits', type=int, nargs='+', default=[10000, 100000], help='history visits per profile, one benchmark per size (default: 10000 100000)')
+	parser.add_argument('-p', '--profiles', type=int, default=1, help='profiles per browser (default: 1)')
+	parser.add_argument('-f', '--formats', nargs='+', default=['csv'], help='output formats to benchmark (default: csv)')
+	parser.add_argument('-z', '--compress', choices=['gzip', 'zstd'], default=None, help='compress the exports (default: none)')
+	parser.add_argument('--compress-thread', action='store_true', default=False, help='compress on a background thread')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='worker processes used for extraction (default: 1)')
+	parser.add_argument('-d', '--data-dir', default=os.path.join(tempfile.gettempdir(), 'browserintel-bench-data'), help='where synthetic profiles are generated and kept for reuse (default: %(default)s)')
+	parser.add_argument('--json', dest='json_file', default=None, help='also write the results to this JSON file')
+	options = parser.parse_args()
+
+	report = []
+	for visits in options.visits:
+		root = os.path.join(options.data_dir, f"{visits}x{options.profiles}")
+		start = time.perf_counter()
+		# A spawned process starts out with its parent's RSS as its peak, so this one is kept small:
+		params = run_fresh(synthetic.generate, root, visits, profiles=options.profiles)
+		print(f"Synthetic data for {visits} visits per profile ready in {root} ({time.perf_counter() - start:.1f}s)")
+		results = run_case(root, params, options.formats, options.jobs, options.compress, options.compress_thread)
+		print_results(visits, results)
+		report.append({'params': params, 'results': results})
+	if options.json_file:
+		with open(options.json_file, 'w') as f:
+			json.dump(report, f, indent=2)
+		print(f"\nWrote {options.json_file}")
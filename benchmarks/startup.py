@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmarks browserintel's cold start: each case runs in a fresh interpreter
+and its wall-clock time is reported as the min and median of several runs.
+
+	import      import browserintel and nothing else
+	help        browserintel.py -h
+	targeted    browserintel.py -pp <one small synthetic Chrome profile> -H
+
+It also checks that the modules only some runs need (pyarrow, NSS, cProfile,
+the process pool) are still left out of a plain import, and exits non-zero
+if one is imported or if --max-ms is given and a median exceeds it.
+
+	python3 benchmarks/startup.py -r 20 --max-ms 250
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import synthetic
+
+# Modules browserintel only imports on the code paths that need them:
+DEFERRED_MODULES = ['pyarrow', 'tools.firefox_decrypt.firefox_decrypt', 'ctypes', 'cProfile', 'pstats', 'concurrent.futures']
+# Loot directory user of the targeted case, removed afterwards:
+LOOT_USER = 'startup-bench'
+
+
+def time_command(command: list, runs: int) -> list:
+	timings = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+		timings.append(time.perf_counter() - start)
+	return timings
+
+
+def get_eager_modules() -> list:
+	"""
+	The deferred modules that a plain import of browserintel pulls in anyway:
+	"""
+	check = f"import sys, browserintel; print(' '.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+	output = subprocess.run([sys.executable, '-c', check], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+	return output.split()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark browserintel's startup time")
+	parser.add_argument('-r', '--runs', type=int, default=10, help='runs per case (default: 10)')
+	parser.add_argument('-d', '--data-dir', default=os.path.join(tempfile.gettempdir(), 'browserintel-bench-data'), help='where the synthetic profile is generated and kept for reuse (default: %(default)s)')
+	parser.add_argument('--max-ms', type=float, default=None, help='exit non-zero if any median startup time exceeds this many milliseconds')
+	options = parser.parse_args()
+
+	root = os.path.join(options.data_dir, 'startup')
+	synthetic.generate(root, 100)
+	profile = os.path.join(synthetic.get_chrome_root(root), 'Default')
+	script = os.path.join(REPO_DIR, 'browserintel.py')
+	cases = [
+		('import', [sys.executable, '-c', 'import browserintel']),
+		('help', [sys.executable, script, '-h']),
+		('targeted', [sys.executable, script, '-u', LOOT_USER, '-pp', profile, '-H']),
+	]
+
+	failed = False
+	print(f"  {'case':<10} {'min ms':>8} {'median ms':>10}")
+	try:
+		for name, command in cases:
+			timings = time_command(command, options.runs)
+			median = statistics.median(timings) * 1000
+			print(f"  {name:<10} {min(timings) * 1000:>8.1f} {median:>10.1f}")
+			if options.max_ms is not None and median > options.max_ms:
+				failed = True
+	finally:
+		shutil.rmtree(os.path.join(REPO_DIR, 'loot', LOOT_USER), ignore_errors=True)
+
+	eager = get_eager_modules()
+	if eager:
+		print(f"\nImported at startup but should be deferred: {', '.join(eager)}")
+		failed = True
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic Chrome and Firefox profiles for benchmarking, laid out
+the way they are on Linux under <root>/home:
+
+	home/.config/google-chrome/{Default,Profile 1,...}/{History,Login Data,Cookies}
+	home/.mozilla/firefox/{bench0.default,...}/{places.sqlite,cookies.sqlite,logins.json}
+
+Timestamps use each browser's own epoch and all data is deterministic for
+a given set of parameters, so repeat runs benchmark identical input.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from tools.timestamps import WEBKIT_EPOCH_OFFSET
+
+# Parameters of a generated data set, kept next to it so it is only rebuilt when they change:
+PARAMS_FILE = 'synthetic.json'
+# Bumped whenever the generated databases change, so data sets built by older versions are rebuilt:
+DATA_VERSION = 2
+# Rows handed to executemany() at a time:
+CHUNK_SIZE = 50000
+# Visit times start here (2023-11-14T22:13:20Z) and move forward:
+START_USEC = 1700000000 * 1000000
+WORDS = ['news', 'mail', 'docs', 'search', 'shop', 'video', 'wiki', 'forum', 'bank', 'cloud', 'maps', 'login', 'blog', 'api', 'cdn']
+TLDS = ['com', 'org', 'net', 'io', 'co.uk', 'de']
+
+
+def get_chrome_root(root):
+	return os.path.join(root, 'home', '.config', 'google-chrome')
+
+
+def get_firefox_root(root):
+	return os.path.join(root, 'home', '.mozilla', 'firefox')
+
+
+def get_profile_counts(visits: int) -> dict:
+	"""
+	Rows generated per profile for a given number of history visits:
+	"""
+	return {
+		'history': visits,
+		'cookies': max(visits // 10, 1),
+		'logins': max(min(visits // 100, 10000), 1),
+	}
+
+
+def make_url(rng, i: int) -> str:
+	host = f"{rng.choice(WORDS)}{i % 5000}.{rng.choice(WORDS)}.{rng.choice(TLDS)}"
+	return f"https://{host}/{rng.choice(WORDS)}/{i}?q={rng.choice(WORDS)}&page={i % 97}"
+
+
+def connect(path):
+	if os.path.exists(path):
+		os.remove(path)
+	conn = sqlite3.connect(path)
+	# Nothing needs to survive a crash while generating:
+	conn.execute('PRAGMA journal_mode=OFF')
+	conn.execute('PRAGMA synchronous=OFF')
+	return conn
+
+
+def insert(conn, statement, rows):
+	rows = iter(rows)
+	while True:
+		chunk = [row for _, row in zip(range(CHUNK_SIZE), rows)]
+		if not chunk:
+			break
+		conn.executemany(statement, chunk)
+	conn.commit()
+
+
+def times(rng, n: int):
+	"""
+	n ascending visit times in Unix epoch microseconds, a few seconds apart:
+	"""
+	usec = START_USEC
+	for _ in range(n):
+		usec += rng.randrange(1000000, 30000000)
+		yield usec
+
+
+def make_chrome_profile(profile, counts: dict, seed: int):
+	rng = random.Random(seed)
+	os.makedirs(os.path.join(profile, 'Cache'), exist_ok=True)
+	webkit = WEBKIT_EPOCH_OFFSET * 1000000
+
+	conn = connect(os.path.join(profile, 'History'))
+	conn.execute('CREATE TABLE urls (id INTEGER PRIMARY KEY AUTOINCREMENT, url LONGVARCHAR, title LONGVARCHAR, visit_count INTEGER DEFAULT 0 NOT NULL, typed_count INTEGER DEFAULT 0 NOT NULL, last_visit_time INTEGER NOT NULL, hidden INTEGER DEFAULT 0 NOT NULL)')
+	conn.execute('CREATE TABLE visits (id INTEGER PRIMARY KEY, url INTEGER NOT NULL, visit_time INTEGER NOT NULL, from_visit INTEGER, transition INTEGER DEFAULT 0 NOT NULL)')
+	# Most URLs are visited several times, and urls keeps each one's visit count and last visit:
+	urls = max(counts['history'] // 4, 1)
+	insert(conn, 'INSERT INTO urls (id, url, title, last_visit_time) VALUES (?, ?, ?, 0)', (
+		(i + 1, make_url(rng, i), f"Page {i}") for i in range(urls)
+	))
+	insert(conn, 'INSERT INTO visits (url, visit_time) VALUES (?, ?)', (
+		(rng.randrange(urls) + 1, usec + webkit) for usec in times(rng, counts['history'])
+	))
+	# The indexes Chrome creates on these tables:
+	conn.execute('CREATE INDEX urls_url_index ON urls (url)')
+	conn.execute('CREATE INDEX visits_url_index ON visits (url)')
+	conn.execute('CREATE INDEX visits_from_index ON visits (from_visit)')
+	conn.execute('CREATE INDEX visits_time_index ON visits (visit_time)')
+	conn.execute('UPDATE urls SET (visit_count, last_visit_time) = (SELECT count(*), coalesce(max(visit_time), 0) FROM visits WHERE visits.url = urls.id)')
+	conn.commit()
+	conn.close()
+
+	conn = connect(os.path.join(profile, 'Login Data'))
+	conn.execute('CREATE TABLE logins (origin_url VARCHAR NOT NULL, action_url VARCHAR, username_element VARCHAR, username_value VARCHAR, password_element VARCHAR, password_value BLOB, date_created INTEGER NOT NULL, date_last_used INTEGER NOT NULL DEFAULT 0)')
+	insert(conn, "INSERT INTO logins VALUES (?, ?, 'user', ?, 'pass', ?, ?, ?)", (
+		(f"https://{rng.choice(WORDS)}{i}.com/", f"https://{rng.choice(WORDS)}{i}.com/login", f"user{i}@example.com", os.urandom(32), usec + webkit, usec + webkit)
+		for i, usec in enumerate(times(rng, counts['logins']))
+	))
+	conn.close()
+
+	conn = connect(os.path.join(profile, 'Cookies'))
+	conn.execute('CREATE TABLE cookies (creation_utc INTEGER NOT NULL, host_key TEXT NOT NULL, name TEXT NOT NULL, value TEXT NOT NULL, path TEXT NOT NULL, expires_utc INTEGER NOT NULL, is_secure INTEGER NOT NULL, is_httponly INTEGER NOT NULL, last_access_utc INTEGER NOT NULL, encrypted_value BLOB DEFAULT \'\')')
+	insert(conn, "INSERT INTO cookies VALUES (?, ?, ?, '', '/', ?, 1, 0, ?, ?)", (
+		(usec + webkit, f".{rng.choice(WORDS)}{i % 5000}.com", f"cookie{i}", usec + webkit + 31536000000000, usec + webkit, os.urandom(24))
+		for i, usec in enumerate(times(rng, counts['cookies']))
+	))
+	conn.close()
+
+
+def make_firefox_profile(profile, counts: dict, seed: int):
+	rng = random.Random(seed)
+	os.makedirs(profile, exist_ok=True)
+
+	conn = connect(os.path.join(profile, 'places.sqlite'))
+	conn.execute('CREATE TABLE moz_places (id INTEGER PRIMARY KEY, url LONGVARCHAR, title LONGVARCHAR, visit_count INTEGER DEFAULT 0)')
+	conn.execute('CREATE TABLE moz_historyvisits (id INTEGER PRIMARY KEY, from_visit INTEGER, place_id INTEGER, visit_date INTEGER, visit_type INTEGER, session INTEGER)')
+	# Most places are visited several times:
+	places = max(counts['history'] // 4, 1)
+	insert(conn, 'INSERT INTO moz_places (id, url, title, visit_count) VALUES (?, ?, ?, 4)', (
+		(i + 1, make_url(rng, i), f"Page {i}") for i in range(places)
+	))
+	insert(conn, 'INSERT INTO moz_historyvisits (place_id, visit_date, visit_type) VALUES (?, ?, 1)', (
+		(rng.randrange(places) + 1, usec) for usec in times(rng, counts['history'])
+	))
+	conn.execute('CREATE INDEX moz_historyvisits_placedateindex ON moz_historyvisits (place_id, visit_date)')
+	conn.execute('CREATE INDEX moz_historyvisits_dateindex ON moz_historyvisits (visit_date)')
+	conn.commit()
+	conn.close()
+
+	conn = connect(os.path.join(profile, 'cookies.sqlite'))
+	conn.execute('CREATE TABLE moz_cookies (id INTEGER PRIMARY KEY, originAttributes TEXT NOT NULL DEFAULT \'\', name TEXT, value TEXT, host TEXT, path TEXT, expiry INTEGER, lastAccessed INTEGER, creationTime INTEGER, isSecure INTEGER, isHttpOnly INTEGER)')
+	insert(conn, "INSERT INTO moz_cookies (name, value, host, path, expiry, lastAccessed, creationTime, isSecure, isHttpOnly) VALUES (?, ?, ?, '/', ?, ?, ?, 1, 0)", (
+		(f"cookie{i}", os.urandom(12).hex(), f".{rng.choice(WORDS)}{i % 5000}.com", usec // 1000000 + 31536000, usec, usec)
+		for i, usec in enumerate(times(rng, counts['cookies']))
+	))
+	conn.close()
+
+	# encType 0 stores usernames and passwords in the clear, so no key is needed to read them back:
+	with open(os.path.join(profile, 'logins.json'), 'w') as f:
+		f.write('{"nextId": %d, "logins": [' % (counts['logins'] + 1))
+		for i, usec in enumerate(times(rng, counts['logins'])):
+			login = {
+				'id': i + 1, 'hostname': f"https://{rng.choice(WORDS)}{i}.com", 'httpRealm': None,
+				'formSubmitURL': f"https://{rng.choice(WORDS)}{i}.com/login", 'usernameField': 'user', 'passwordField': 'pass',
+				'encryptedUsername': f"user{i}@example.com", 'encryptedPassword': os.urandom(9).hex(), 'encType': 0,
+				'timeCreated': usec // 1000, 'timeLastUsed': usec // 1000, 'timePasswordChanged': usec // 1000, 'timesUsed': 1,
+			}
+			f.write(('' if i == 0 else ', ') + json.dumps(login))
+		f.write('], "version": 3}')
+	create_key_database(profile)
+
+
+def create_key_database(profile):
+	"""
+	NSS has to initialize a profile before firefox_decrypt reads its logins,
+	so create an empty, unprotected key database when libnss is available:
+	"""
+	from tools.firefox_decrypt import firefox_decrypt
+	try:
+		nss = firefox_decrypt.load_libnss()
+	except firefox_decrypt.Exit:
+		print(f"libnss not found, Firefox logins in {profile} can't be extracted", file=sys.stderr)
+		return
+	for name in ['key4.db', 'cert9.db', 'pkcs11.txt']:
+		if os.path.exists(os.path.join(profile, name)):
+			os.remove(os.path.join(profile, name))
+	if nss.NSS_InitReadWrite(f"sql:{profile}".encode()) != 0:
+		return
+	nss.PK11_GetInternalKeySlot.restype = firefox_decrypt.ct.c_void_p
+	slot = firefox_decrypt.ct.c_void_p(nss.PK11_GetInternalKeySlot())
+	nss.PK11_InitPin(slot, None, b'')
+	nss.PK11_FreeSlot(slot)
+	nss.NSS_Shutdown()
+
+
+def generate(root, visits: int, profiles=1, seed=0) -> dict:
+	"""
+	Builds (or reuses, if it was already built with the same parameters) a
+	synthetic home under root with the given number of Chrome and Firefox
+	profiles, each holding the given number of history visits:
+	:return: the data set's parameters, including the rows per artifact
+	"""
+	params = {'visits': visits, 'profiles': profiles, 'seed': seed, 'version': DATA_VERSION, 'counts': get_profile_counts(visits)}
+	params_file = os.path.join(root, PARAMS_FILE)
+	if os.path.isfile(params_file):
+		with open(params_file, 'r') as f:
+			if json.load(f) == params:
+				return params
+	chrome_root = get_chrome_root(root)
+	firefox_root = get_firefox_root(root)
+	os.makedirs(chrome_root, exist_ok=True)
+	os.makedirs(firefox_root, exist_ok=True)
+	names = ['Default'] + [f"Profile {i}" for i in range(1, profiles)]
+	for i, name in enumerate(names):
+		make_chrome_profile(os.path.join(chrome_root, name), params['counts'], seed + i)
+	with open(os.path.join(chrome_root, 'Local State'), 'w') as f:
+		json.dump({'profile': {'info_cache': {name: {'name': f"Person {i + 1}"} for i, name in enumerate(names)}}}, f)
+	with open(os.path.join(firefox_root, 'profiles.ini'), 'w') as f:
+		f.write('[General]\nStartWithLastProfile=1\n')
+		for i in range(profiles):
+			make_firefox_profile(os.path.join(firefox_root, f"bench{i}.default"), params['counts'], seed + 1000 + i)
+			f.write(f"\n[Profile{i}]\nName=bench{i}\nIsRelative=1\nPath=bench{i}.default\nDefault={int(i == 0)}\n")
+	with open(params_file, 'w') as f:
+		json.dump(params, f)
+	return params
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Generate synthetic Chrome and Firefox profiles')
+	parser.add_argument('root', help='directory to create the synthetic home in')
+	parser.add_argument('-n', '--visits', type=int, default=10000, help='history visits per profile (default: 10000)')
+	parser.add_argument('-p', '--profiles', type=int, default=1, help='profiles per browser (default: 1)')
+	parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+	options = parser.parse_args()
+	print(json.dumps(generate(options.root, options.visits, profiles=options.profiles, seed=options.seed), indent=2))
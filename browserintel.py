@@ -2,16 +2,86 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import contextlib
 import glob
+import hashlib
+import heapq
+import io
+import itertools
+import json
 import sqlite3
+import time
 
+from tools import db, stats
+from tools.export import COMPRESSED_EXTENSIONS, PREVIEW_ROWS, WRITERS, check_compress, check_format, export_rows, format_preview, get_output_path
+from tools.manifest import MANIFEST_FILE, load_manifest, save_manifest
+from tools.store import Store
+from tools.timestamps import PRTIME, UNIX, UNIX_MS, WEBKIT, iso, timestamp_columns, timestamp_values, unix_usec
 from tools.utils import *
-from tools.xplat import Info
+from tools.xplat import Info, is_within
 
 # Make sure Python >=v3.6:
 check_python_version = "hacky workaround"
 if_you_see_this_message = f"YOU ARE NOT RUNNING Python 3.6+ {check_python_version}"
 
+# Rows pulled from sqlite per fetchmany() call:
+BATCH_SIZE = 10000
+# Hex digits of the profile path hash in output names:
+PROFILE_HASH_LENGTH = 8
+
+# Database and query behind each (browser, artifact) pair:
+ARTIFACT_DATABASES = {
+	('chrome', 'history'): 'History',
+	('chrome', 'logins'): 'Login Data',
+	('mozilla', 'history'): 'places.sqlite',
+	('mozilla', 'cookies'): 'cookies.sqlite',
+}
+ARTIFACT_QUERIES = {
+	('chrome', 'history'): f"SELECT {timestamp_columns('v.visit_time', WEBKIT, 'visit_time')}, u.url FROM visits AS v, urls AS u WHERE u.id == v.url ORDER BY v.visit_time ASC, v.id ASC",
+	('chrome', 'logins'): f"SELECT {timestamp_columns('date_created', WEBKIT, 'date_created')}, {timestamp_columns('date_last_used', WEBKIT, 'date_last_used')}, origin_url, action_url, username_value FROM logins ORDER BY origin_url",
+	('mozilla', 'history'): f"SELECT {timestamp_columns('h.visit_date', PRTIME, 'visit_time')}, p.url FROM moz_historyvisits AS h, moz_places AS p WHERE p.id == h.place_id ORDER BY h.visit_date ASC, h.id ASC",
+	('mozilla', 'cookies'): f"SELECT host, name, value, path, {timestamp_columns('expiry', UNIX, 'expiry')}, {timestamp_columns('lastAccessed', PRTIME, 'last_accessed')}, {timestamp_columns('creationTime', PRTIME, 'creation_time')}, isSecure AS is_secure, isHttpOnly AS is_httponly FROM moz_cookies ORDER BY host",
+}
+# History high-water marks: the newest (timestamp, row id) pair, and the visits after a stored pair up
+# to it (after (-1, -1) for a full export). Both are keyed on the visits table, whose time index (plus
+# the rowid) covers them, so an incremental run only reads the index tail and its new visits. Every
+# mode exports one row per visit, as ARTIFACT_QUERIES does:
+HISTORY_MARK_TABLES = {
+	'chrome': 'visits',
+	'mozilla': 'moz_historyvisits',
+}
+HISTORY_MARK_QUERIES = {
+	'chrome': "SELECT visit_time, id FROM visits ORDER BY visit_time DESC, id DESC LIMIT 1",
+	'mozilla': "SELECT visit_date, id FROM moz_historyvisits ORDER BY visit_date DESC, id DESC LIMIT 1",
+}
+HISTORY_RANGE_QUERIES = {
+	'chrome': f"SELECT {timestamp_columns('v.visit_time', WEBKIT, 'visit_time')}, u.url FROM visits AS v, urls AS u WHERE u.id == v.url AND (v.visit_time, v.id) > (:since_time, :since_id) AND (v.visit_time, v.id) <= (:until_time, :until_id) ORDER BY v.visit_time ASC, v.id ASC",
+	'mozilla': f"SELECT {timestamp_columns('h.visit_date', PRTIME, 'visit_time')}, p.url FROM moz_historyvisits AS h, moz_places AS p WHERE p.id == h.place_id AND (h.visit_date, h.id) > (:since_time, :since_id) AND (h.visit_date, h.id) <= (:until_time, :until_id) ORDER BY h.visit_date ASC, h.id ASC",
+}
+STATE_FILE = '.state.json'
+# Timeline: history ordered by visit time, led by the visit time in Unix epoch microseconds (also the merge key):
+TIMELINE_QUERIES = {
+	'chrome': f"SELECT {unix_usec('v.visit_time', WEBKIT)}, {iso('v.visit_time', WEBKIT)}, u.url FROM visits AS v, urls AS u WHERE u.id == v.url ORDER BY v.visit_time ASC, v.id ASC",
+	'mozilla': f"SELECT {unix_usec('h.visit_date', PRTIME)}, {iso('h.visit_date', PRTIME)}, p.url FROM moz_historyvisits AS h, moz_places AS p WHERE p.id == h.place_id ORDER BY h.visit_date ASC, h.id ASC",
+}
+TIMELINE_HEADERS = ['visit_time', 'visit_time_usec', 'browser', 'profile', 'url']
+ARTIFACT_LABELS = {
+	'history': 'History data',
+	'cookies': 'Cookies',
+	'logins': 'Login data',
+}
+
+# Files a Mozilla profile keeps its saved logins in (newest format first):
+MOZILLA_LOGIN_FILES = ['logins.json', 'signons.sqlite']
+# Column headers of decrypted Mozilla logins, with their Unix millisecond timestamps:
+MOZILLA_LOGIN_HEADERS = [
+	'url', 'user', 'password', 'date_created', 'date_created_raw',
+	'date_last_used', 'date_last_used_raw', 'date_password_changed', 'date_password_changed_raw',
+]
+
+# NSS is loaded once per process, on the first Mozilla logins extraction:
+mozilla_interaction = None
+
 # Change to script directory:
 script_path = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_path)
@@ -21,122 +91,431 @@ def div():
 	print("-" * get_terminal_size())
 
 
-def write_query_to_csv(db_copy, output_csv, query=None):
-	if not os.path.isfile(db_copy):
-		err("Can't find database path")
-	conn = sqlite3.connect(db_copy)
-	c = conn.cursor()
-	data = c.execute(query)
-	headers = list(map(lambda x: x[0], c.description))
-	with open(output_csv, 'w') as f:
-		f.write(','.join(headers))
-		f.write('\n')
-		for line in data.fetchall():
-			row = ','.join([str(i) for i in line])
-			f.write(row)
-			f.write('\n')
-	c.close()
-	conn.close()
-	os.remove(db_copy)
+def write_query(conn, output_file, query=None, params=(), append=False, on_batch=None, fmt='csv', batch_size=BATCH_SIZE, preview=0, compress=None, compress_thread=False):
+	with stats.stage('export', format=fmt, compress=compress) as record:
+		start = time.perf_counter()
+		headers, batches = db.read_batches(conn, query, params, arraysize=batch_size)
+		export = export_rows(output_file, headers, batches, fmt=fmt, append=append, on_batch=on_batch, preview=preview, compress=compress, threaded=compress_thread)
+		elapsed = time.perf_counter() - start
+		record['rows'] = export.rows
+		record['bytes'] = export.bytes
+	print(f"Exported {export.rows} rows to {os.path.basename(export.path)} in {elapsed:.2f}s ({rows_per_sec(export.rows, elapsed)} rows/sec)")
+	return export
+
+
+def rows_per_sec(rows: int, elapsed: float) -> int:
+	if elapsed <= 0:
+		return rows
+	return int(rows / elapsed)
+
+
+def load_state(loot_dir) -> dict:
+	state_file = os.path.join(loot_dir, STATE_FILE)
+	if not os.path.isfile(state_file):
+		return {}
+	with open(state_file, 'r') as f:
+		try:
+			return json.load(f)
+		except ValueError:
+			warn(f"Ignoring unreadable state file {state_file}")
+			return {}
+
+
+def save_state(loot_dir, state: dict):
+	state_file = os.path.join(loot_dir, STATE_FILE)
+	with open(f"{state_file}.tmp", 'w') as f:
+		json.dump(state, f, indent=2, sort_keys=True)
+	os.replace(f"{state_file}.tmp", state_file)
+
+
+def discover_profiles(info, directories: list, loot_dir, is_profile=False, rescan=False, evidence=False) -> dict:
+	"""
+	Returns the profiles under directories, reusing the discovery manifest
+	cached in loot_dir unless something it watches has changed or rescan is set.
+	evidence marks directories from a collected home rather than this machine:
+	"""
+	directories = [os.path.abspath(directory) for directory in directories if directory]
+	key = json.dumps({'directories': directories, 'is_profile': is_profile, 'evidence': evidence}, sort_keys=True)
+	with stats.scope(loot_dir=loot_dir), stats.stage('discovery', cached=False) as record:
+		profiles = None if rescan else load_manifest(loot_dir, key)
+		if profiles is not None:
+			record['cached'] = True
+			print(f"Using cached profile discovery from {os.path.join(loot_dir, MANIFEST_FILE)} (use --rescan to refresh)")
+		else:
+			profiles = info.get_profiles(directories=directories, is_profile=is_profile, evidence=evidence)
+			save_manifest(loot_dir, key, directories, profiles, is_profile=is_profile)
+		record['rows'] = sum(len(browser_profiles) for browser_profiles in profiles.values())
+	return profiles
 
 
 def get_filename(profile: str, chrome=False, mozilla=False):
+	"""
+	Output name of a profile. Different installs share profile and parent
+	names (every Windows Chrome channel ends in 'User Data/Default'), so a
+	short hash of the full profile path keeps the names of the exports,
+	database copies and incremental state of two profiles apart:
+	"""
 	profile_name = os.path.basename(profile)
 	profile_split = profile.split('/')
 	parent = ''.join(profile_split[len(profile_split)-2:len(profile_split)-1])
+	digest = hashlib.sha1(os.path.abspath(profile).encode('utf-8', 'surrogateescape')).hexdigest()[:PROFILE_HASH_LENGTH]
 	if chrome:
-		return f"chrome_{parent}_{profile_name}".replace(' ', '-').lower()
+		return f"chrome_{parent}_{profile_name}_{digest}".replace(' ', '-').lower()
 	if mozilla:
-		return f"mozilla_{parent}_{profile_name}".replace(' ', '-').lower()
+		return f"mozilla_{parent}_{profile_name}_{digest}".replace(' ', '-').lower()
 
 
-def delete_if_empty(filename: str) -> bool:
-	if os.path.isfile(filename):
-		with open(filename, 'r') as f:
-			lines = f.readlines()
-	if len(lines) <= 2:
-		os.remove(filename)
-		return False
-	return True
+def show_export(export, label, profile):
+	"""
+	Reports an export from the counts and preview rows gathered while it was
+	written (removing it if nothing was exported), without reading it back:
+	"""
+	if export.rows == 0:
+		if os.path.isfile(export.path):
+			os.remove(export.path)
+		return
+	print(f"{label} for profile {profile} written to {export.path} ({export.rows} rows, {stats.format_bytes(export.bytes)})")
+	if export.preview:
+		print(f"\n{format_preview(export)}")
 
 
-def cleanup():
-	directory = f"{script_path}/loot/{user}"
+def cleanup(directory):
 	os.chdir(directory)
 	dbs = ['Cookies', 'cookies.sqlite', 'Login Data', 'logins.json', 'History', 'places.sqlite']
-	for db in dbs:
-		if os.path.isfile(db):
-			os.remove(db)
-
-
-def get_data(browser_dict: dict, cookies=None, logins=False, history=False, masterpass=None):
-	os.chdir(loot_dir)
-	chrome_profiles = browser_dict['chrome']
-	mozilla_profiles = browser_dict['mozilla']
-	for profile in chrome_profiles:
-		profile_name = os.path.basename(profile)
-		filename = get_filename(profile, chrome=True)
-		if cookies:
-			div()
-			warn("Chrome cookie data only sometimes available with '-A'")
-		if logins:
-			div()
-			db_orig = os.path.join(profile, 'Login Data')
-			db_copy = f"{loot_dir}/Login Data"
-			shutil.copy(db_orig, db_copy)
-			logins_file = f"{loot_dir}/{filename}_logins.csv"
-			write_query_to_csv(db_copy, logins_file, query="SELECT date_created, date_last_used, origin_url, action_url, username_value FROM logins ORDER BY origin_url")
-			warn("Chrome can only show decrypted passwords with the '-L' option")
-			if delete_if_empty(logins_file):
-				print(f"Login data for profile {profile}:\n")
-				with open(logins_file, 'r') as f:
-					print(f.read())
-		if history:
-			div()
-			db_orig = os.path.join(profile, 'History')
-			db_copy = f"{loot_dir}/History"
-			shutil.copy(db_orig, db_copy)
-			history_file = f"{loot_dir}/{filename}_history.csv"
-			write_query_to_csv(db_copy, history_file, query="SELECT datetime(last_visit_time/1000000-11644473600,'unixepoch'),url FROM urls ORDER BY last_visit_time ASC")
-			if delete_if_empty(history_file):
-				print(f"History data for profile {profile}:\n")
-				with open(history_file, 'r') as f:
-					print(f.read())
-	for profile in mozilla_profiles:
-		profile_name = os.path.basename(profile)
-		filename = get_filename(profile, mozilla=True)
-		if cookies:
-			div()
-			db_orig = os.path.join(profile, 'cookies.sqlite')
-			db_copy = f"{loot_dir}/cookies.sqlite"
-			shutil.copy(db_orig, db_copy)
-			cookies_file = f"{loot_dir}/{filename}_cookies.csv"
-			write_query_to_csv(db_copy, cookies_file, query="SELECT * FROM moz_cookies ORDER BY host")
-			if delete_if_empty(cookies_file):
-				print(f"Cookies for profile {profile}:\n")
-				with open(cookies_file, 'r') as f:
-					print(f.read())
-		if history:
-			div()
-			db_orig = os.path.join(profile, 'places.sqlite')
-			db_copy = f"{loot_dir}/places.sqlite"
-			shutil.copy(db_orig, db_copy)
-			history_file = f"{loot_dir}/{filename}_history.csv"
-			write_query_to_csv(db_copy, history_file, query="SELECT datetime(h.visit_date/1000000,'unixepoch'),p.url FROM moz_historyvisits AS h, moz_places AS p WHERE p.id == h.place_id ORDER BY h.visit_date ASC;")
-			if delete_if_empty(history_file):
-				print(f"History data for profile {profile}:\n")
-				with open(history_file, 'r') as f:
-					print(f.read())
-		if logins:
-			div()
-			logins_file = f"{loot_dir}/{filename}_logins.csv"
-			login_output = os.popen(f'echo {masterpass} | {python} "{script_path}/tools/firefox_decrypt/firefox_decrypt.py" "{profile}" -n --format csv --csv-delimiter ","').read()
-			print(f"Login data for profile {profile}:\n")
-			with open(logins_file, 'w') as f:
-				f.write(login_output)
-			if delete_if_empty(logins_file):
-				print(login_output)
-			del login_output
+	for dbname in dbs:
+		for path in glob.glob(f"*{dbname}"):
+			if os.path.isfile(path):
+				os.remove(path)
+
+
+def get_profile_database(databases, profile, dbname, filename, loot_dir):
+	"""
+	Opens profile/dbname the first time an artifact needs it during a profile
+	visit and hands back the same connection for every later artifact:
+	"""
+	return databases.get(os.path.join(profile, dbname), f"{loot_dir}/{filename}_{dbname}")
+
+
+def get_mozilla_interaction():
+	"""
+	Returns this process's firefox_decrypt.MozillaInteraction, loading libnss the
+	first time and reusing it for every later profile, or None if it can't be loaded:
+	"""
+	global mozilla_interaction
+	if mozilla_interaction is None:
+		# ctypes and NSS are only loaded once a profile's logins are extracted:
+		from tools.firefox_decrypt import firefox_decrypt
+		try:
+			mozilla_interaction = firefox_decrypt.MozillaInteraction()
+		except firefox_decrypt.Exit:
+			mozilla_interaction = False
+	return mozilla_interaction or None
+
+
+def iter_mozilla_logins(profile, masterpass=None, batch_size=BATCH_SIZE):
+	"""
+	Decrypts a Mozilla profile's saved logins in-process through NSS, yielding
+	batches of MOZILLA_LOGIN_HEADERS rows as logins.json is streamed in.
+	A profile that never saved a login has nothing to decrypt and yields nothing:
+	"""
+	if not any(os.path.isfile(os.path.join(profile, name)) for name in MOZILLA_LOGIN_FILES):
+		return
+	from tools.firefox_decrypt import firefox_decrypt
+	moz = get_mozilla_interaction()
+	if moz is None:
+		warn('Unable to load libnss, skipping Mozilla logins')
+		return
+	try:
+		moz.load_profile(profile)
+	except firefox_decrypt.Exit:
+		warn(f"Unable to initialize NSS for profile {profile}")
+		return
+	try:
+		moz.authenticate(False, password=masterpass or '')
+		logins = (
+			[login['url'], login['user'], login['password']]
+			+ timestamp_values(login['timeCreated'], UNIX_MS)
+			+ timestamp_values(login['timeLastUsed'], UNIX_MS)
+			+ timestamp_values(login['timePasswordChanged'], UNIX_MS)
+			for login in moz.decrypt_passwords(times=True)
+		)
+		yield from iter(lambda: list(itertools.islice(logins, batch_size)), [])
+	except firefox_decrypt.Exit as e:
+		if e.exitcode == firefox_decrypt.Exit.MISSING_SECRETS:
+			return
+		if e.exitcode in (firefox_decrypt.Exit.BAD_MASTER_PASSWORD, firefox_decrypt.Exit.NEED_MASTER_PASSWORD):
+			warn(f"Logins for profile {profile} are protected by a master password, use '-p' to supply it")
+		else:
+			warn(f"Unable to decrypt logins for profile {profile}")
+	finally:
+		moz.unload_profile()
+
+
+def plan_extraction(browser_dict: dict, artifacts: list) -> list:
+	"""
+	Builds the extraction plan once: one (browser, profile, artifacts) entry per profile,
+	keeping only the artifacts whose database actually exists in that profile.
+	"""
+	plan = []
+	for browser in ['chrome', 'mozilla']:
+		for profile in browser_dict[browser]:
+			wanted = []
+			for artifact in artifacts:
+				dbname = ARTIFACT_DATABASES.get((browser, artifact))
+				if dbname and not os.path.isfile(os.path.join(profile, dbname)):
+					continue
+				wanted.append(artifact)
+			if wanted:
+				plan.append((browser, profile, wanted))
+	return plan
+
+
+def extract_profile(browser, profile, artifacts, loot_dir, masterpass=None, readonly=False, marks=None, store_path=None, fmt='csv', mem_stats=False, preview=PREVIEW_ROWS, compress=None, compress_thread=False) -> dict:
+	"""
+	Extracts the requested artifacts from a single profile.
+	History is exported one row per visit, up to a new high-water mark that
+	is returned for the state file. If marks (the profile's marks from the
+	state file, for -I) is given, only the visits after the recorded mark are
+	appended; without one the history is written from scratch.
+	If store_path is given, every exported batch is also bulk-inserted into
+	that consolidated SQLite store, each batch in its own short transaction.
+	If mem_stats is set, each artifact's tracemalloc peak and RSS are recorded.
+	The first preview rows of each export are echoed to the console.
+	If compress is given, exports are compressed as they are written, on a
+	background thread if compress_thread is set.
+	:return: dict of updated high-water marks
+	"""
+	if mem_stats:
+		stats.start_memory_tracing()
+	filename = get_filename(profile, chrome=browser == 'chrome', mozilla=browser == 'mozilla')
+	databases = db.Connections(readonly=readonly)
+	new_marks = {}
+	# Incremental history is only appended once a mark has been recorded for it (marks from
+	# before they were keyed on HISTORY_MARK_TABLES start over too):
+	history_mark = marks.get('history') if marks else None
+	if history_mark and history_mark.get('table') != HISTORY_MARK_TABLES[browser]:
+		history_mark = None
+	store = None
+	div()
+	print(f"Extracting {', '.join(artifacts)} from {browser} profile {profile}")
+	with stats.scope(loot_dir=loot_dir, profile=profile), stats.stage('profile', browser=browser):
+		try:
+			if store_path:
+				store = Store(store_path)
+				profile_id = store.begin_profile(browser, profile)
+		except (sqlite3.DatabaseError, OSError) as e:
+			warn(f"Can't write {browser} profile {profile} to the store {store_path}, exporting it without the store: {e}")
+			if store:
+				store.close()
+			store = None
+		try:
+			for artifact in artifacts:
+				with stats.scope(artifact=artifact), stats.stage('artifact', memory=True):
+					div()
+					try:
+						if browser == 'chrome' and artifact == 'cookies':
+							warn("Chrome cookie data only sometimes available with '-A'")
+							continue
+						on_batch = None
+						if store:
+							if not (artifact == 'history' and history_mark):
+								store.clear(artifact, profile_id)
+							on_batch = store.writer(artifact, profile_id)
+						if browser == 'mozilla' and artifact == 'logins':
+							logins_file = f"{loot_dir}/{filename}_logins.{fmt}"
+							with stats.stage('export', format=fmt, compress=compress) as record:
+								export = export_rows(logins_file, MOZILLA_LOGIN_HEADERS, iter_mozilla_logins(profile, masterpass=masterpass), fmt=fmt, on_batch=on_batch, preview=preview, compress=compress, threaded=compress_thread)
+								record['rows'] = export.rows
+								record['bytes'] = export.bytes
+							show_export(export, ARTIFACT_LABELS[artifact], profile)
+							continue
+						dbname = ARTIFACT_DATABASES[(browser, artifact)]
+						conn = get_profile_database(databases, profile, dbname, filename, loot_dir)
+						output_file = f"{loot_dir}/{filename}_{artifact}.{fmt}"
+						if artifact == 'history':
+							until = db.fetch_one(conn, HISTORY_MARK_QUERIES[browser])
+							if not until:
+								new_marks['history'] = None
+								print(f"No history in profile {profile}")
+								continue
+							since = history_mark or {'time': -1, 'id': -1}
+							append = bool(history_mark)
+							existed = append and os.path.isfile(get_output_path(output_file, fmt, compress))
+							params = {'since_time': since['time'], 'since_id': since['id'], 'until_time': until[0], 'until_id': until[1]}
+							export = write_query(conn, output_file, query=HISTORY_RANGE_QUERIES[browser], params=params, append=append, on_batch=on_batch, fmt=fmt, preview=preview, compress=compress, compress_thread=compress_thread)
+							# A full export replaces the recorded mark too, so a later -I run continues from it:
+							new_marks['history'] = {'table': HISTORY_MARK_TABLES[browser], 'time': until[0], 'id': until[1]}
+							if existed:
+								print(f"Appended {export.rows} new history rows for profile {profile} to {export.path}")
+								continue
+						else:
+							export = write_query(conn, output_file, query=ARTIFACT_QUERIES[(browser, artifact)], on_batch=on_batch, fmt=fmt, preview=preview, compress=compress, compress_thread=compress_thread)
+						if browser == 'chrome' and artifact == 'logins':
+							warn("Chrome can only show decrypted passwords with the '-L' option")
+						show_export(export, ARTIFACT_LABELS[artifact], profile)
+					except (sqlite3.DatabaseError, OSError) as e:
+						# A damaged or unreadable database only costs this artifact, not the run:
+						dbname = ARTIFACT_DATABASES.get((browser, artifact))
+						warn(f"Skipping {artifact} of {browser} profile {profile}, can't read {os.path.join(profile, dbname) if dbname else profile}: {e}")
+		finally:
+			if store:
+				store.close()
+			databases.close()
+	return new_marks
+
+
+def extract_profile_captured(*args, **kwargs):
+	"""
+	Runs extract_profile() in a worker process, buffering its console output
+	so the parent can print it in plan order:
+	:return: tuple (output, exit code or None, high-water marks, stage records)
+	"""
+	# A forked worker starts out with a copy of the parent's records:
+	stats.RECORDS.clear()
+	output = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(output):
+			marks = extract_profile(*args, **kwargs)
+	except SystemExit as e:
+		return output.getvalue(), e.code, {}, stats.take()
+	return output.getvalue(), None, marks, stats.take()
+
+
+def iter_timeline(conn, browser, profile_name, path, batch_size=BATCH_SIZE):
+	"""
+	Yields a profile's visits for the timeline merge; a database that turns out
+	to be damaged part way through only ends its own stream:
+	"""
+	try:
+		_, batches = db.read_batches(conn, TIMELINE_QUERIES[browser], arraysize=batch_size)
+		for batch in batches:
+			for visit_usec, visit_time, url in batch:
+				yield visit_usec, (visit_time, visit_usec, browser, profile_name, url)
+	except (sqlite3.DatabaseError, OSError) as e:
+		warn(f"Leaving the rest of {path} out of the timeline, can't read it: {e}")
+
+
+def write_timeline(browser_dict: dict, loot_dir, fmt='csv', batch_size=BATCH_SIZE, compress=None, compress_thread=False) -> int:
+	"""
+	Merges the already ordered history of every profile into one chronological
+	file with a heap-based k-way merge, holding one cursor per profile in memory
+	rather than every visit. Extraction has already copied and removed each
+	History, so it is read in place (immutable, like -R) rather than copied
+	again, unless an un-checkpointed WAL or a lock sends it to a copy:
+	"""
+	databases = db.Connections(readonly=True)
+	start = time.perf_counter()
+	with stats.scope(loot_dir=loot_dir), stats.stage('timeline', memory=True, format=fmt) as record:
+		try:
+			streams = []
+			for browser, profile, _ in plan_extraction(browser_dict, ['history']):
+				filename = get_filename(profile, chrome=browser == 'chrome', mozilla=browser == 'mozilla')
+				dbname = ARTIFACT_DATABASES[(browser, 'history')]
+				path = os.path.join(profile, dbname)
+				try:
+					conn = get_profile_database(databases, profile, dbname, filename, loot_dir)
+				except (sqlite3.DatabaseError, OSError) as e:
+					warn(f"Leaving {path} out of the timeline, can't read it: {e}")
+					continue
+				streams.append(iter_timeline(conn, browser, filename, path, batch_size=batch_size))
+			merged = (row for _, row in heapq.merge(*streams, key=lambda visit: visit[0]))
+			batches = iter(lambda: list(itertools.islice(merged, batch_size)), [])
+			timeline_file = f"{loot_dir}/timeline.{fmt}"
+			export = export_rows(timeline_file, TIMELINE_HEADERS, batches, fmt=fmt, compress=compress, threaded=compress_thread)
+		finally:
+			databases.close()
+		record['rows'] = export.rows
+		record['bytes'] = export.bytes
+	elapsed = time.perf_counter() - start
+	div()
+	print(f"Merged {export.rows} visits from {len(streams)} profiles into {os.path.basename(export.path)} in {elapsed:.2f}s ({rows_per_sec(export.rows, elapsed)} rows/sec)")
+	return export.rows
+
+
+def run_units(units: list, jobs=1):
+	"""
+	Runs extract_profile() for each (args, kwargs) unit, either inline or on a
+	pool of worker processes, yielding each unit's result in plan order:
+	"""
+	if jobs <= 1 or len(units) <= 1:
+		for args, kwargs in units:
+			yield extract_profile(*args, **kwargs)
+		return
+	from concurrent.futures import ProcessPoolExecutor
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		futures = [executor.submit(extract_profile_captured, *args, **kwargs) for args, kwargs in units]
+		# Print results in plan order so output is deterministic regardless of scheduling:
+		for future in futures:
+			output, exitcode, result, records = future.result()
+			stats.RECORDS.extend(records)
+			print(output, end='')
+			if exitcode is not None:
+				# Drop the units that haven't started (shutdown(cancel_futures=True) needs Python 3.9):
+				for pending in futures:
+					pending.cancel()
+				sys.exit(exitcode)
+			yield result
+
+
+def get_data(homes: list, cookies=None, logins=False, history=False, masterpass=None, readonly=False, jobs=1, incremental=False, store=None, fmt='csv', mem_stats=False, preview=PREVIEW_ROWS, compress=None, compress_thread=False):
+	"""
+	Extracts every profile of every (loot directory, profiles) home through a
+	single worker pool, keeping the history marks and the store per loot directory:
+	"""
+	artifacts = [artifact for artifact, wanted in [('history', history), ('cookies', cookies), ('logins', logins)] if wanted]
+	states = {}
+	store_paths = {}
+	units = []
+	for home_loot_dir, browser_dict in homes:
+		# Every history export moves the profile's mark, not just incremental ones:
+		states[home_loot_dir] = load_state(home_loot_dir) if history or incremental else None
+		store_paths[home_loot_dir] = os.path.join(home_loot_dir, store) if store else None
+		if store:
+			# Create the schema up front so workers don't race to do it:
+			Store(store_paths[home_loot_dir]).close()
+		for browser, profile, wanted in plan_extraction(browser_dict, artifacts):
+			marks = None
+			if incremental:
+				marks = states[home_loot_dir].get(get_filename(profile, chrome=browser == 'chrome', mozilla=browser == 'mozilla'), {}).get('marks', {})
+			units.append(((browser, profile, wanted, home_loot_dir), {'masterpass': masterpass, 'readonly': readonly, 'marks': marks, 'store_path': store_paths[home_loot_dir], 'fmt': fmt, 'mem_stats': mem_stats, 'preview': preview, 'compress': compress, 'compress_thread': compress_thread}))
+	for ((browser, profile, _, home_loot_dir), _), marks in zip(units, run_units(units, jobs=jobs)):
+		state = states[home_loot_dir]
+		if state is not None and marks:
+			key = get_filename(profile, chrome=browser == 'chrome', mozilla=browser == 'mozilla')
+			state.setdefault(key, {'profile': profile, 'marks': {}})['marks'].update(marks)
+			save_state(home_loot_dir, state)
+	for home_loot_dir, store_path in store_paths.items():
+		if store_path:
+			with stats.scope(loot_dir=home_loot_dir), stats.stage('store_index'):
+				store_db = Store(store_path)
+				store_db.create_indexes()
+				store_db.close()
+			print(f"Stored extracted data in {store_path}")
+
+
+def get_evidence_homes(info, evidence_root, rescan=False) -> list:
+	"""
+	Treats every subdirectory of evidence_root as a collected home directory,
+	searches it with the Linux, macOS and Windows browser layouts, and gives
+	each one its own loot/<home name> directory:
+	:return: list of (loot directory, profiles) pairs for homes with profiles
+	"""
+	homes = []
+	for home in sorted(scan(evidence_root)[0]):
+		directories = []
+		for platform in ['Linux', 'Darwin', 'Windows']:
+			directories += info.get_browser(platform=platform, home=home, listbrowsers=True)
+		for directory in [directory for directory in directories if not is_within(directory, home)]:
+			warn(f"Skipping {directory}: it resolves outside {home}")
+			directories.remove(directory)
+		if not directories:
+			continue
+		home_loot_dir = f"{script_path}/loot/{os.path.basename(home)}"
+		os.makedirs(home_loot_dir, exist_ok=True)
+		profiles = discover_profiles(info, directories, home_loot_dir, rescan=rescan, evidence=True)
+		if any(profiles.values()):
+			homes.append((home_loot_dir, profiles))
+	return homes
 
 
 if __name__ == '__main__':
@@ -150,12 +529,34 @@ if __name__ == '__main__':
 	string_group.add_argument('-cp', '--cookies-path', action='store', dest='cookies_path', default=None, help='path to cookies database')
 	string_group.add_argument('-hp', '--history-path', action='store', dest='history_path', default=None, help='path to history database')
 	string_group.add_argument('-lp', '--logins-path', action='store', dest='logins_path', default=None, help='path to logins database')
+	string_group.add_argument('-e', '--evidence-root', action='store', dest='evidence_root', default=None, help='directory of collected home directories (e.g. a mounted image\'s /home or Users) to extract every user\'s profiles from, each into loot/<home name>')
+	string_group.add_argument('-s', '--store', action='store', dest='store', default=None, help='also bulk-insert all extracted data into this SQLite database (relative paths are placed in the loot directory)')
+	string_group.add_argument('-f', '--format', action='store', dest='format', choices=sorted(WRITERS), default='csv', help='output format for extracted data (parquet requires pyarrow; default: csv)')
+	string_group.add_argument('-z', '--compress', action='store', dest='compress', choices=sorted(COMPRESSED_EXTENSIONS), default=None, help='compress exports as they are written (.gz/.zst; zstd requires the zstandard package); parquet uses it as its page codec')
+	string_group.add_argument('--preview', action='store', dest='preview', type=int, default=PREVIEW_ROWS, help=f"rows of each export to echo to the console, 0 for none (default: {PREVIEW_ROWS})")
+	string_group.add_argument('-j', '--jobs', action='store', dest='jobs', type=int, default=1, help='number of worker processes used to extract profiles in parallel (default: 1)')
 	bool_group = parser.add_argument_group('Boolean options')
 	bool_group.add_argument('-A', '--all', action='store_true', dest='all_true', default=False, help='Attempt to gather all data from all installed browsers (except for IE)')
 	bool_group.add_argument('-C', '--cookies', action='store_true', dest='cookies_true', default=False, help='attempt to gather cookies information')
 	bool_group.add_argument('-H', '--history', action='store_true', dest='history_true', default=False, help='attempt to gather history information')
 	bool_group.add_argument('-L', '--logins', action='store_true', dest='logins_true', default=False, help='attempt to gather login information')
+	bool_group.add_argument('-I', '--incremental', action='store_true', dest='incremental', default=False, help='only export history newer than the previous run and append it to the existing files')
+	bool_group.add_argument('-T', '--timeline', action='store_true', dest='timeline', default=False, help='merge the history of all profiles into one chronologically ordered timeline file')
+	bool_group.add_argument('--rescan', action='store_true', dest='rescan', default=False, help='ignore the cached profile discovery manifest and walk the browser directories again')
+	bool_group.add_argument('-R', '--read-only', action='store_true', dest='read_only', default=False, help='open databases in place (read-only, immutable) instead of copying them to the loot directory')
+	bool_group.add_argument('--compress-thread', action='store_true', dest='compress_thread', default=False, help='with -z, compress on a background thread so compression overlaps with the database reads')
+	bool_group.add_argument('--stats', action='store_true', dest='stats', default=False, help=f"write a JSON report of the time, rows and bytes of every stage, per profile and artifact, to {stats.STATS_FILE} in the loot directory")
+	bool_group.add_argument('--mem-stats', action='store_true', dest='mem_stats', default=False, help='record the tracemalloc peak and (on Linux) RSS high-water mark of every profile and artifact and list them in the run summary (slows extraction down)')
+	bool_group.add_argument('--profile', action='store_true', dest='profile', default=False, help=f"also run under cProfile, saving {stats.PROFILE_FILE} and listing the hot spots in the --stats report (worker processes started by -j aren't profiled)")
 	options = parser.parse_args()
+	run_start = time.perf_counter()
+	if options.mem_stats:
+		stats.start_memory_tracing()
+	profiler = None
+	if options.profile:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
 
 	info = Info()
 	python = info.python
@@ -165,72 +566,105 @@ if __name__ == '__main__':
 
 	loot_dir = f"{script_path}/loot/{user}"
 	os.makedirs(loot_dir, exist_ok=True)
+	check_format(options.format)
+	check_compress(options.compress, options.format)
 
-	profile_dirs = None
-	if options.profile_dir:
-		if os.path.isdir(options.profile_dir):
-			profile_dirs = info.get_profiles(directories=[options.profile_dir], is_profile=True)
-		else:
-			err('Invalid profile path')
-	if options.browser_dir and not options.profile_dir:
-		if os.path.isdir(options.browser_dir):
-			profile_dirs = info.get_profiles(directories=[options.browser_dir])
-		else:
-			err('Invalid browser path')
-	if not options.browser_dir and not options.profile_dir:
-		# browser_dir = info.get_browser_dir()
-		# installed_browsers = info.get_browser()
-		# profiles = info.get_profiles(installed_browsers)
-		profile_dirs = info.get_profiles(automatic=True)
-		if info.arch == 'Windows':
-			sys.exit()
+	if options.evidence_root:
+		if not os.path.isdir(options.evidence_root):
+			err('Invalid evidence root')
+		homes = get_evidence_homes(info, options.evidence_root, rescan=options.rescan)
+	else:
+		directories = None
+		is_profile = False
+		if options.profile_dir:
+			if os.path.isdir(options.profile_dir):
+				directories = [options.profile_dir]
+				is_profile = True
+			else:
+				err('Invalid profile path')
+		if options.browser_dir and not options.profile_dir:
+			if os.path.isdir(options.browser_dir):
+				directories = [options.browser_dir]
+			else:
+				err('Invalid browser path')
+		if not options.browser_dir and not options.profile_dir:
+			# browser_dir = info.get_browser_dir()
+			# installed_browsers = info.get_browser()
+			# profiles = info.get_profiles(installed_browsers)
+			directories = info.get_browser(listbrowsers=True)
+		profile_dirs = discover_profiles(info, directories, loot_dir, is_profile=is_profile, rescan=options.rescan)
+		if not options.browser_dir and not options.profile_dir:
+			if info.arch == 'Windows':
+				sys.exit()
+		homes = [(loot_dir, profile_dirs)]
 
 	numprofiles = 0
-	for _, v in profile_dirs.items():
-		numprofiles += len(v)
+	for _, profile_dirs in homes:
+		for _, v in profile_dirs.items():
+			numprofiles += len(v)
 	if numprofiles == 0:
 		err('No profiles found')
 
 	# Get History:
-	if options.history_true or options.history_path:
-		if options.history_path:
-			if not os.path.isfile(options.history_path):
-				err('Check history path.')
-		get_data(profile_dirs, history=True)
+	if options.history_path:
+		if not os.path.isfile(options.history_path):
+			err('Check history path.')
 	# Get Cookies:
-	if options.cookies_true or options.cookies_path:
-		if options.cookies_path:
-			if not os.path.isfile(options.cookies_path):
-				err('Check cookies path')
-		get_data(profile_dirs, cookies=True)
+	if options.cookies_path:
+		if not os.path.isfile(options.cookies_path):
+			err('Check cookies path')
 	# Get Login Data:
-	if options.logins_true or options.logins_path:
-		if options.logins_path:
-			if not os.path.isfile(options.logins_path):
-				err('Check logins path')
-		get_data(profile_dirs, logins=True)
-	# Get All (using golang binaries under './tools/hackbrowserdata'):
-	if options.all_true:
+	if options.logins_path:
+		if not os.path.isfile(options.logins_path):
+			err('Check logins path')
+	# History, cookies and logins are extracted in a single pass over each profile:
+	get_data(
+		homes,
+		history=options.history_true or options.history_path,
+		cookies=options.cookies_true or options.cookies_path,
+		logins=options.logins_true or options.logins_path,
+		masterpass=options.master_password,
+		readonly=options.read_only,
+		jobs=options.jobs,
+		incremental=options.incremental,
+		store=options.store,
+		fmt=options.format,
+		mem_stats=options.mem_stats,
+		preview=options.preview,
+		compress=options.compress,
+		compress_thread=options.compress_thread
+	)
+	if options.timeline:
+		for home_loot_dir, profile_dirs in homes:
+			write_timeline(profile_dirs, home_loot_dir, fmt=options.format, compress=options.compress, compress_thread=options.compress_thread)
+	# Get All (using golang binaries under './tools/hackbrowserdata'), which only reads this machine's browsers:
+	if options.all_true and not options.evidence_root:
 		hackbrowserdata = os.path.abspath(f"tools/hackbrowserdata/hbd-{info.platform}-{info.arch}")
 		if info.arm and info.platform == 'Linux':
 			hackbrowserdata = os.path.abspath(f"tools/hackbrowserdata/hbd-{info.platform}-{info.arm}")
 		elif info.platform == 'Windows':
 			hackbrowserdata = f"{hackbrowserdata}.exe"
-		os.chdir(f"./loot/{user}")
+		os.chdir(loot_dir)
 		output = os.popen(f"{hackbrowserdata}").read()
 		for file in glob.glob("results/*"):
 			file = os.path.basename(file)
 			shutil.move(os.path.join(f"{script_path}/loot/{user}/results/{file}"), os.path.join(f"{script_path}/loot/{user}/{file}"))
 		os.rmdir('./results')
 
-	cleanup()
-	div()
-	print(f"Contents of {script_path}/loot/{user}:\n")
-	for file in os.listdir(f"{script_path}/loot/{user}"):
-		print(file)
+	if profiler is not None:
+		profiler.disable()
+	for home_loot_dir, _ in homes:
+		cleanup(home_loot_dir)
+		if options.stats or options.profile or options.mem_stats:
+			stats_file = stats.write_report(home_loot_dir, stats.RECORDS, time.perf_counter() - run_start, profiler=profiler, argv=sys.argv[1:], jobs=options.jobs, format=options.format, compress=options.compress)
+			print(f"Wrote stage timings to {stats_file}")
+		div()
+		print(f"Contents of {home_loot_dir}:\n")
+		for file in os.listdir(home_loot_dir):
+			print(file)
 	div()
-
-
-
-
-
+	if options.mem_stats:
+		print("Memory per profile and artifact (tracemalloc peak, RSS high-water mark while it ran, Linux only):\n")
+		for line in stats.get_memory_summary(stats.RECORDS):
+			print(line)
+		div()
@@ -0,0 +1,68 @@
+"""
+Regression tests for firefox_decrypt's JsonStream, which decodes logins.json
+a chunk at a time: every value has to come out the same as json.loads()
+however the chunk boundaries fall through it.
+
+	python3 -m unittest discover tests
+"""
+import io
+import json
+import os
+import sys
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from tools.firefox_decrypt.firefox_decrypt import JsonStream
+
+# Chunk sizes small enough for boundaries to fall inside every token:
+CHUNK_SIZES = range(1, 17)
+
+DOCUMENTS = [
+	'{"a": 1.25, "logins": [1]}',
+	'{"nextId":12345,"logins":[-0.5,1e3,2E-2,-12.5e+2,0,123456789012345678901234567890],"version":3}',
+	'{"skip": [true, false, null, {"x": [1.5, -2]}], "logins": [true, false, null], "after": 7}',
+	'{"logins": ["quote \\" backslash \\\\ slash \\/ tab \\t newline \\n", "\\u00e9\\u65e5\\ud83d\\ude00"]}',
+	'{"title": "café 日本", "logins": ["naïve résumé", "日本語", "\U0001f600\U0001f511"]}',
+	'{ "logins" : [ { "id" : 1 , "hostname" : "https://éxample.com" , "encType" : 1 , "timeCreated" : 1700000000123 } ] }',
+	'{"logins": []}',
+]
+
+
+def decode(document: str, chunk_size: int) -> list:
+	return list(JsonStream(io.StringIO(document), chunk_size=chunk_size).iter_key('logins'))
+
+
+class JsonStreamTest(unittest.TestCase):
+	def test_matches_json_loads_at_every_chunk_size(self):
+		for document in DOCUMENTS:
+			expected = json.loads(document)['logins']
+			for chunk_size in CHUNK_SIZES:
+				with self.subTest(document=document, chunk_size=chunk_size):
+					self.assertEqual(decode(document, chunk_size), expected)
+
+	def test_logins_json_round_trip(self):
+		logins = [
+			{'id': i, 'hostname': f"https://site{i}.éxample.org", 'encryptedUsername': f"usér{i}\"\\",
+			 'encType': 1, 'timeCreated': 1700000000000 + i * 1.5, 'timeLastUsed': -i}
+			for i in range(20)
+		]
+		document = json.dumps({'nextId': 21, 'logins': logins, 'version': 3}, ensure_ascii=False)
+		for chunk_size in CHUNK_SIZES:
+			with self.subTest(chunk_size=chunk_size):
+				self.assertEqual(decode(document, chunk_size), logins)
+
+	def test_missing_key(self):
+		for chunk_size in CHUNK_SIZES:
+			with self.subTest(chunk_size=chunk_size):
+				with self.assertRaises(KeyError):
+					decode('{"nextId": 1.5, "version": 3}', chunk_size)
+
+	def test_truncated_document(self):
+		with self.assertRaises(ValueError):
+			decode('{"logins": [1.25, 2', 4)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,167 @@
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+from tools import stats
+from tools.utils import *
+
+# Rows pulled from sqlite per fetchmany() call:
+ARRAYSIZE = 10000
+# Bytes of each database that reads go through a memory map for:
+MMAP_SIZE = 256 * 1024 * 1024
+# Page cache per connection (negative values are KiB, so 64 MiB):
+CACHE_SIZE = -64 * 1024
+
+# Read-optimized settings applied to every extraction connection:
+PRAGMAS = {
+	'query_only': 'ON',
+	'mmap_size': MMAP_SIZE,
+	'cache_size': CACHE_SIZE,
+	'temp_store': 'MEMORY',
+}
+
+
+class Connection(sqlite3.Connection):
+	"""
+	sqlite3 connection that remembers which file it was opened on, for timings.
+	"""
+	path = None
+
+
+def get_uri(path, immutable=False) -> str:
+	"""
+	Read-only file: URI for path. immutable=1 also skips all locking and
+	change detection, so only use it on files nothing is writing to:
+	"""
+	uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+	if immutable:
+		uri += '&immutable=1'
+	return uri
+
+
+def connect(path, immutable=False, pragmas=None) -> Connection:
+	"""
+	Opens path read-only for extraction with PRAGMAS (overridden by pragmas)
+	applied: writes refused, reads served through mmap, a larger page cache
+	and temporary b-trees (sorts, DISTINCT) kept in memory:
+	"""
+	conn = sqlite3.connect(get_uri(path, immutable=immutable), uri=True, factory=Connection)
+	conn.path = str(path)
+	for name, value in {**PRAGMAS, **(pragmas or {})}.items():
+		conn.execute(f"PRAGMA {name}={value}")
+	return conn
+
+
+def has_pending_wal(db_path) -> bool:
+	wal = f"{db_path}-wal"
+	return os.path.isfile(wal) and os.path.getsize(wal) > 0
+
+
+def open_database(db_orig, db_copy, readonly=False, pragmas=None):
+	"""
+	Opens db_orig in place (read-only and immutable) when readonly is set,
+	otherwise (or if the database is locked or has an un-checkpointed WAL)
+	copies it to db_copy first. Nothing is ever written next to db_orig.
+	Returns the connection and the copy's path, or None if nothing was copied.
+	"""
+	if readonly:
+		if has_pending_wal(db_orig):
+			warn(f"{db_orig} has an un-checkpointed write-ahead log, falling back to a copy")
+		else:
+			try:
+				conn = connect(db_orig, immutable=True, pragmas=pragmas)
+				try:
+					conn.execute('SELECT count(*) FROM sqlite_master').fetchone()
+				except sqlite3.OperationalError:
+					conn.close()
+					raise
+				return conn, None
+			except sqlite3.OperationalError as e:
+				warn(f"Can't open {db_orig} in place ({e}), falling back to a copy")
+	with stats.stage('copy', database=str(db_orig)) as record:
+		shutil.copy(db_orig, db_copy)
+		record['bytes'] = os.path.getsize(db_copy)
+		if has_pending_wal(db_orig):
+			shutil.copy(f"{db_orig}-wal", f"{db_copy}-wal")
+			record['bytes'] += os.path.getsize(f"{db_copy}-wal")
+	return connect(db_copy, pragmas=pragmas), db_copy
+
+
+def remove_database_copy(db_copy):
+	for path in [db_copy, f"{db_copy}-wal", f"{db_copy}-shm"]:
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+
+class Connections:
+	"""
+	Connection factory: opens each source database the first time a query
+	needs it and hands the same connection to every later query against it,
+	until close() closes them all and removes any copies that were made.
+	"""
+	def __init__(self, readonly=False, pragmas=None):
+		self.readonly = readonly
+		self.pragmas = pragmas
+		self.connections = {}
+
+	def get(self, db_orig, db_copy) -> Connection:
+		if db_orig not in self.connections:
+			self.connections[db_orig] = open_database(db_orig, db_copy, readonly=self.readonly, pragmas=self.pragmas)
+		return self.connections[db_orig][0]
+
+	def close(self):
+		for conn, db_copy in self.connections.values():
+			conn.close()
+			if db_copy:
+				remove_database_copy(db_copy)
+		self.connections.clear()
+
+
+def record_timing(conn, rows, seconds):
+	"""
+	Adds a query's time inside SQLite to the --stats report, as a 'query' stage:
+	"""
+	stats.record('query', seconds, rows=rows, database=getattr(conn, 'path', None))
+
+
+def fetch_one(conn, query, params=()):
+	start = time.perf_counter()
+	row = conn.execute(query, params).fetchone()
+	record_timing(conn, 0 if row is None else 1, time.perf_counter() - start)
+	return row
+
+
+def read_batches(conn, query, params=(), arraysize=ARRAYSIZE):
+	"""
+	Runs query and returns its column names along with an iterator over
+	batches of up to arraysize rows; the cursor is closed once the iterator
+	is exhausted or discarded. The time spent inside SQLite (not in whatever
+	consumes the batches) is recorded by record_timing():
+	:return: (headers, batches)
+	"""
+	start = time.perf_counter()
+	c = conn.cursor()
+	c.arraysize = arraysize
+	c.execute(query, params)
+	headers = [column[0] for column in c.description]
+	elapsed = time.perf_counter() - start
+
+	def batches():
+		nonlocal elapsed
+		rows = 0
+		try:
+			while True:
+				start = time.perf_counter()
+				batch = c.fetchmany()
+				elapsed += time.perf_counter() - start
+				if not batch:
+					break
+				rows += len(batch)
+				yield batch
+		finally:
+			c.close()
+			record_timing(conn, rows, elapsed)
+	return headers, batches()
@@ -0,0 +1,328 @@
+import csv
+import io
+import json
+import queue
+import threading
+from collections import namedtuple
+
+from tools.stats import get_file_size
+from tools.timestamps import ISO_FORMAT, TIMESTAMP_COLUMNS
+from tools.utils import *
+
+# Imported by import_pyarrow() on first use, False once it has turned out to be missing:
+pyarrow = None
+
+# Bytes buffered per text output file:
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Extension added to text exports for each --compress method:
+COMPRESSED_EXTENSIONS = {
+	'gzip': '.gz',
+	'zstd': '.zst',
+}
+# gzip's default of 9 is several times slower for barely smaller files:
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Write buffers queued for the background compression thread before writes block:
+COMPRESS_QUEUE_DEPTH = 4
+# Rows of each export kept for the console preview:
+PREVIEW_ROWS = 10
+# Longest preview line printed before it is cut short:
+PREVIEW_WIDTH = 200
+
+# What export_rows() wrote: the file (a parquet part file when appending), its
+# headers, the rows and bytes written and the first rows, for the console:
+Export = namedtuple('Export', ['path', 'headers', 'rows', 'bytes', 'preview'])
+
+
+class Writer:
+	"""
+	Streaming export writer: open() with the column headers, then write()
+	each batch of rows as it is fetched, then close().
+	"""
+	extension = None
+
+	def __init__(self, path, append=False, compress=None, threaded=False):
+		self.path = get_output_path(path, self.extension, compress)
+		self.append = append
+		self.compress = compress
+		self.threaded = threaded
+
+	def open(self, headers: list):
+		self.headers = headers
+		# Appends only count the bytes added to the existing file:
+		self.initial_size = get_file_size(self.path) if self.append else 0
+
+	def get_bytes_written(self) -> int:
+		"""
+		Bytes this writer added to its file, once it is closed:
+		"""
+		return get_file_size(self.path) - self.initial_size
+
+	def open_file(self, **kwargs):
+		"""
+		Opens the text stream that write() goes to, compressing it in-stream
+		(on a background thread if threaded is set) when compress is given:
+		"""
+		mode = 'a' if self.append else 'w'
+		if not self.compress:
+			return open(self.path, mode, buffering=WRITE_BUFFER_SIZE, **kwargs)
+		stream = open_compressed(self.path, f"{mode}b", self.compress)
+		if self.threaded:
+			stream = BackgroundStream(stream)
+		return io.TextIOWrapper(io.BufferedWriter(stream, buffer_size=WRITE_BUFFER_SIZE), **kwargs)
+
+	def write(self, rows: list):
+		pass
+
+	def close(self):
+		pass
+
+
+class CSVWriter(Writer):
+	extension = 'csv'
+
+	def open(self, headers: list):
+		super().open(headers)
+		# When appending to an existing export the header is already there:
+		write_header = not (self.append and os.path.isfile(self.path) and os.path.getsize(self.path) > 0)
+		self.file = self.open_file(newline='')
+		self.writer = csv.writer(self.file, lineterminator='\n')
+		if write_header:
+			self.writer.writerow(headers)
+
+	def write(self, rows: list):
+		self.writer.writerows(rows)
+
+	def close(self):
+		self.file.close()
+
+
+class JSONLWriter(Writer):
+	"""
+	Writes one JSON object per row, flushing after every batch so the file
+	can be tailed while the export is still running.
+	"""
+	extension = 'jsonl'
+
+	def open(self, headers: list):
+		super().open(headers)
+		self.file = self.open_file(encoding='utf-8')
+
+	def write(self, rows: list):
+		headers = self.headers
+		self.file.write(''.join(f"{json.dumps(dict(zip(headers, row)), ensure_ascii=False, default=json_default)}\n" for row in rows))
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+
+def json_default(value):
+	if isinstance(value, bytes):
+		return value.hex()
+	return str(value)
+
+
+class ParquetWriter(Writer):
+	"""
+	Writes each batch as a columnar record batch; the ISO-8601 timestamp
+	columns are parsed into typed timestamps a whole column at a time.
+	Parquet files can't be appended to, so appends go to the next free
+	<name>.<n>.parquet part file next to the original. Parquet compresses
+	its own pages, with zstd unless --compress picks the codec.
+	"""
+	extension = 'parquet'
+
+	def __init__(self, path, append=False, compress=None, threaded=False):
+		super().__init__(path, append, compress, threaded)
+		import_pyarrow()
+		if append and os.path.isfile(path):
+			stem = path[:-len(f".{self.extension}")]
+			part = 1
+			while os.path.isfile(f"{stem}.{part}.{self.extension}"):
+				part += 1
+			self.path = f"{stem}.{part}.{self.extension}"
+		self.writer = None
+		self.schema = None
+
+	def write(self, rows: list):
+		columns = list(zip(*rows))
+		arrays = []
+		for i, name in enumerate(self.headers):
+			if name in TIMESTAMP_COLUMNS:
+				array = pyarrow.compute.strptime(pyarrow.array(columns[i], type=pyarrow.string()), format=ISO_FORMAT, unit='s').cast(pyarrow.timestamp('s', tz='UTC'))
+			elif self.schema:
+				array = pyarrow.array(columns[i], type=self.schema.field(i).type)
+			else:
+				array = pyarrow.array(columns[i])
+				if pyarrow.types.is_null(array.type):
+					array = array.cast(pyarrow.string())
+			arrays.append(array)
+		batch = pyarrow.RecordBatch.from_arrays(arrays, names=self.headers)
+		if self.writer is None:
+			self.schema = batch.schema
+			self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compress or 'zstd')
+		self.writer.write_batch(batch)
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+
+
+class BackgroundStream(io.RawIOBase):
+	"""
+	Binary stream that hands every write to a background thread, which
+	passes it on to the (compressing) stream underneath. zlib and zstd
+	release the GIL while compressing, so compression overlaps with fetching
+	the next batch from SQLite. Errors in the thread are raised by the next
+	write() or by close().
+	"""
+	def __init__(self, stream, depth=COMPRESS_QUEUE_DEPTH):
+		super().__init__()
+		self.stream = stream
+		self.queue = queue.Queue(maxsize=depth)
+		self.error = None
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		if self.error:
+			raise self.error
+		# The caller reuses its buffer, so queue a copy:
+		self.queue.put(bytes(data))
+		return len(data)
+
+	def run(self):
+		while True:
+			data = self.queue.get()
+			if data is None:
+				break
+			if self.error is None:
+				try:
+					self.stream.write(data)
+				except Exception as e:
+					self.error = e
+
+	def close(self):
+		if self.closed:
+			return
+		self.queue.put(None)
+		self.thread.join()
+		try:
+			self.stream.close()
+		finally:
+			super().close()
+		if self.error:
+			raise self.error
+
+
+def get_output_path(path, fmt='csv', compress=None) -> str:
+	"""
+	The file an export to path ends up in: text formats get the compression's
+	extension added, parquet compresses internally and keeps its name:
+	"""
+	if compress and fmt != 'parquet':
+		return f"{path}{COMPRESSED_EXTENSIONS[compress]}"
+	return path
+
+
+def open_compressed(path, mode: str, compress: str):
+	"""
+	Binary stream compressing everything written through it into path.
+	Appending adds a new gzip member or zstd frame, which decompressors read
+	back as one continuous stream:
+	"""
+	if compress == 'gzip':
+		import gzip
+		return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+	zstandard = import_zstandard()
+	return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, mode), closefd=True, write_return_read=True)
+
+
+def import_zstandard():
+	"""
+	The optional zstandard package behind '--compress zstd', or None:
+	"""
+	try:
+		import zstandard
+	except ImportError:
+		return None
+	return zstandard
+
+
+def import_pyarrow():
+	"""
+	Imports the optional pyarrow package the first time a parquet export
+	needs it, since importing it takes longer than all of browserintel's own
+	startup; csv and jsonl runs never pay for it:
+	:return: the pyarrow module, or None if it isn't installed
+	"""
+	global pyarrow
+	if pyarrow is None:
+		try:
+			import pyarrow.compute
+			import pyarrow.parquet
+		except ImportError:
+			pyarrow = False
+	return pyarrow or None
+
+
+WRITERS = {
+	'csv': CSVWriter,
+	'jsonl': JSONLWriter,
+	'parquet': ParquetWriter,
+}
+
+
+def check_format(fmt: str):
+	if fmt == 'parquet' and import_pyarrow() is None:
+		err("'--format parquet' requires the optional pyarrow package (pip install pyarrow)")
+
+
+def check_compress(compress: str, fmt='csv'):
+	if compress == 'zstd' and fmt != 'parquet' and import_zstandard() is None:
+		err("'--compress zstd' requires the optional zstandard package (pip install zstandard)")
+
+
+def export_rows(output_file, headers: list, batches, fmt='csv', append=False, on_batch=None, preview=0, compress=None, threaded=False) -> Export:
+	"""
+	Streams batches of rows into output_file in the requested format,
+	compressed with compress (see Writer.open_file()) if given, and passes
+	each batch on to on_batch(headers, rows) as well. Rows and bytes
+	are counted and the first preview rows kept as they go by, so nothing
+	has to read the file back afterwards:
+	:return: Export
+	"""
+	writer = WRITERS[fmt](output_file, append=append, compress=compress, threaded=threaded)
+	writer.open(headers)
+	rows = 0
+	head = []
+	try:
+		for batch in batches:
+			writer.write(batch)
+			if on_batch:
+				on_batch(headers, batch)
+			if len(head) < preview:
+				head += batch[:preview - len(head)]
+			rows += len(batch)
+	finally:
+		writer.close()
+	return Export(writer.path, headers, rows, writer.get_bytes_written(), head)
+
+
+def format_preview(export: Export, width=PREVIEW_WIDTH) -> str:
+	"""
+	The header and preview rows of an export as CSV lines, each cut to width
+	characters, followed by a count of the rows left out:
+	"""
+	output = io.StringIO()
+	writer = csv.writer(output, lineterminator='\n')
+	writer.writerow(export.headers)
+	writer.writerows(export.preview)
+	lines = [line if len(line) <= width else f"{line[:width - 3]}..." for line in output.getvalue().splitlines()]
+	if export.rows > len(export.preview):
+		lines.append(f"... and {export.rows - len(export.preview)} more rows")
+	return '\n'.join(lines)
@@ -30,20 +30,35 @@ import sqlite3
 import sys
 import shutil
 from base64 import b64decode
+from pathlib import Path
 from getpass import getpass
 from itertools import chain
 from subprocess import run, PIPE, DEVNULL
+from textwrap import indent
 from urllib.parse import urlparse
 from configparser import ConfigParser
 from typing import Optional, Iterator, Any
 
-LOG: logging.Logger
+try:
+	# browserintel's shared SQLite access layer, when imported from there
+	from tools import db as db_access
+except ImportError:
+	db_access = None
+
+# Defined at import time so the module can also be driven without main():
+LOG: logging.Logger = logging.getLogger(__name__)
 VERBOSE = False
 SYSTEM = platform.system()
 SYS64 = sys.maxsize > 2**32
 DEFAULT_ENCODING = "utf-8"
+# Rows fetched per batch from signons.sqlite
+SQLITE_ARRAYSIZE = 1000
+# Login timestamps (Unix milliseconds) kept by both credential stores
+LOGIN_TIME_FIELDS = ("timeCreated", "timeLastUsed", "timePasswordChanged")
+# Characters that can follow a complete number or literal in logins.json
+JSON_DELIMITERS = ",]} \t\n\r"
 
-#PWStore = list[dict[str, str]]
+#PWStore = Iterator[dict[str, str]]
 
 # NOTE: In 1.0.0-rc1 we tried to use locale information to encode/decode
 # content passed to NSS. This was an attempt to address the encoding issues
@@ -133,7 +148,7 @@ class Credentials:
 
 		LOG.info("Using %s for credentials.", db)
 
-	def __iter__(self) -> Iterator[tuple[str, str, str, int]]:
+	def __iter__(self) -> Iterator[tuple[str, str, str, int, tuple]]:
 		pass
 
 	def done(self):
@@ -151,16 +166,30 @@ class SqliteCredentials(Credentials):
 
 		super(SqliteCredentials, self).__init__(db)
 
-		self.conn = sqlite3.connect(db)
+		if db_access is not None:
+			self.conn = db_access.connect(db)
+		else:
+			self.conn = sqlite3.connect(f"{Path(db).resolve().as_uri()}?mode=ro", uri=True)
+			self.conn.execute("PRAGMA query_only=ON")
 		self.c = self.conn.cursor()
+		self.c.arraysize = SQLITE_ARRAYSIZE
 
-	def __iter__(self) -> Iterator[tuple[str, str, str, int]]:
+	def __iter__(self) -> Iterator[tuple[str, str, str, int, tuple]]:
 		LOG.debug("Reading password database in SQLite format")
-		self.c.execute("SELECT hostname, encryptedUsername, encryptedPassword, encType "
-					   "FROM moz_logins")
-		for i in self.c:
-			# yields hostname, encryptedUsername, encryptedPassword, encType
-			yield i
+		# Older signons.sqlite schemas predate the login timestamps
+		columns = {row[1] for row in self.conn.execute("PRAGMA table_info(moz_logins)")}
+		times = ", ".join(c if c in columns else "NULL" for c in LOGIN_TIME_FIELDS)
+		query = ("SELECT hostname, encryptedUsername, encryptedPassword, encType, "
+				 f"{times} FROM moz_logins")
+		if db_access is not None:
+			_, batches = db_access.read_batches(self.conn, query, arraysize=SQLITE_ARRAYSIZE)
+		else:
+			self.c.execute(query)
+			batches = iter(self.c.fetchmany, [])
+		for batch in batches:
+			# yields hostname, encryptedUsername, encryptedPassword, encType, (times)
+			for row in batch:
+				yield (*row[:4], tuple(row[4:]))
 
 	def done(self):
 		"""Close the sqlite cursor and database connection
@@ -171,6 +200,94 @@ class SqliteCredentials(Credentials):
 		self.conn.close()
 
 
+class JsonStream:
+	"""Incremental JSON reader that decodes one value at a time from a text
+	file, holding only the unread part of the current chunk in memory
+	"""
+	def __init__(self, fh, chunk_size=64 * 1024):
+		self.fh = fh
+		self.chunk_size = chunk_size
+		self.buf = ""
+		self.pos = 0
+		self.eof = False
+		self.decoder = json.JSONDecoder()
+
+	def fill(self) -> bool:
+		"""Append the next chunk of the file to the unread buffer
+		"""
+		if self.eof:
+			return False
+		chunk = self.fh.read(self.chunk_size)
+		if not chunk:
+			self.eof = True
+			return False
+		self.buf = self.buf[self.pos:] + chunk
+		self.pos = 0
+		return True
+
+	def peek(self) -> str:
+		"""Skip whitespace and return the next character ('' at end of file)
+		"""
+		while True:
+			while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+				self.pos += 1
+			if self.pos < len(self.buf):
+				return self.buf[self.pos]
+			if not self.fill():
+				return ""
+
+	def expect(self, chars: str) -> str:
+		"""Consume the next character, which must be one of chars
+		"""
+		char = self.peek()
+		if not char or char not in chars:
+			raise ValueError(f"Expected one of {chars!r} but found {char!r}")
+		self.pos += 1
+		return char
+
+	def value(self) -> Any:
+		"""Decode the next complete JSON value, reading more of the file
+		for as long as the value is cut off by the end of the buffer
+		"""
+		# Strings, objects and arrays end with their own closing character
+		scalar = self.peek() not in '"{['
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buf, self.pos)
+			except ValueError:
+				if self.fill():
+					continue
+				raise
+			# A number cut off by the chunk boundary decodes as a shorter
+			# one ("1." as 1), so it is only complete once a delimiter follows
+			if scalar and (end == len(self.buf) or self.buf[end] not in JSON_DELIMITERS) and self.fill():
+				continue
+			self.pos = end
+			return value
+
+	def iter_key(self, key: str) -> Iterator[Any]:
+		"""Yield the elements of the array stored under key in the top-level
+		object one by one, skipping over the values of the other keys
+		"""
+		self.expect("{")
+		if self.peek() == "}":
+			raise KeyError(key)
+		while True:
+			name = self.value()
+			self.expect(":")
+			if name == key:
+				self.expect("[")
+				if self.peek() == "]":
+					return
+				while True:
+					yield self.value()
+					if self.expect(",]") == "]":
+						return
+			self.value()
+			if self.expect(",}") == "}":
+				raise KeyError(key)
+
+
 class JsonCredentials(Credentials):
 	"""JSON credentials backend manager
 	"""
@@ -179,20 +296,111 @@ class JsonCredentials(Credentials):
 
 		super(JsonCredentials, self).__init__(db)
 
-	def __iter__(self) -> Iterator[tuple[str, str, str, int]]:
+	def __iter__(self) -> Iterator[tuple[str, str, str, int, tuple]]:
 		with open(self.db) as fh:
 			LOG.debug("Reading password database in JSON format")
-			data = json.load(fh)
-
+			# Logins are decoded one at a time rather than loading the whole file
 			try:
-				logins = data["logins"]
-			except Exception:
+				for i in JsonStream(fh).iter_key("logins"):
+					yield (i["hostname"], i["encryptedUsername"],
+						   i["encryptedPassword"], i["encType"],
+						   tuple(i.get(field) for field in LOGIN_TIME_FIELDS))
+			except (KeyError, TypeError, ValueError):
 				LOG.error(f"Unrecognized format in {self.db}")
 				raise Exit(Exit.BAD_SECRETS)
 
-			for i in logins:
-				yield (i["hostname"], i["encryptedUsername"],
-					   i["encryptedPassword"], i["encType"])
+
+def get_nss_cache_file() -> str:
+	"""Location of the on-disk cache of the resolved NSS library path
+	"""
+	if SYSTEM == "Windows":
+		cache_dir = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+	elif SYSTEM == "Darwin":
+		cache_dir = os.path.expanduser("~/Library/Caches")
+	else:
+		cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+	return os.path.join(cache_dir, "firefox_decrypt", "nss.json")
+
+
+def get_nss_cache_key() -> str:
+	"""The library that loads depends on the platform and on the bitness of
+	the running interpreter, so both are part of the key
+	"""
+	return f"{SYSTEM}:{platform.machine()}:{sys.executable}"
+
+
+def read_nss_cache() -> dict:
+	try:
+		with open(get_nss_cache_file()) as fh:
+			cache = json.load(fh)
+	except (OSError, ValueError):
+		return {}
+	return cache if isinstance(cache, dict) else {}
+
+
+def save_nss_cache(nsslib: str):
+	"""Remember where NSS was found, along with its mtime and size
+	"""
+	try:
+		st = os.stat(nsslib)
+		cache = read_nss_cache()
+		cache[get_nss_cache_key()] = {"path": nsslib, "signature": [st.st_mtime_ns, st.st_size]}
+		cache_file = get_nss_cache_file()
+		os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+		with open(f"{cache_file}.tmp", "w") as fh:
+			json.dump(cache, fh, indent=2)
+		os.replace(f"{cache_file}.tmp", cache_file)
+	except OSError as e:
+		LOG.debug("Couldn't cache NSS location: %s", e)
+
+
+def load_cached_nss() -> Optional[ct.CDLL]:
+	"""Load NSS from the cached location if a single stat shows the library
+	is still there, unchanged
+	"""
+	entry = read_nss_cache().get(get_nss_cache_key())
+	if not entry:
+		return None
+	try:
+		st = os.stat(entry["path"])
+	except (OSError, KeyError, TypeError):
+		return None
+	if [st.st_mtime_ns, st.st_size] != entry.get("signature"):
+		return None
+	try:
+		nss = open_nss(os.path.dirname(entry["path"]), os.path.basename(entry["path"]))
+	except OSError as e:
+		LOG.debug("Couldn't load cached NSS library %s: %s", entry["path"], e)
+		return None
+	LOG.debug("Loaded NSS library from cached location %s", entry["path"])
+	return nss
+
+
+def open_nss(loc, nssname) -> ct.CDLL:
+	"""Load nssname from loc, raising OSError if that fails
+	"""
+	nsslib = os.path.join(loc, nssname)
+	LOG.debug("Loading NSS library from %s", nsslib)
+
+	OS = ("Windows", "Darwin")
+	if SYSTEM in OS:
+		# On windows in order to find DLLs referenced by nss3.dll
+		# we need to have those locations on PATH
+		os.environ["PATH"] = ';'.join([loc, os.environ["PATH"]])
+		LOG.debug("PATH is now %s", os.environ["PATH"])
+		# However this doesn't seem to work on all setups and needs to be
+		# set before starting python so as a workaround we chdir to
+		# Firefox's nss3.dll/libnss3.dylib location
+		if loc:
+			workdir = os.getcwd()
+			os.chdir(loc)
+
+	try:
+		return ct.CDLL(nsslib)
+	finally:
+		if SYSTEM in OS and loc:
+			# Restore workdir changed above
+			os.chdir(workdir)
 
 
 def find_nss(locations, nssname) -> ct.CDLL:
@@ -200,39 +408,24 @@ def find_nss(locations, nssname) -> ct.CDLL:
 	"""
 	fail_errors: list[tuple[str, str]] = []
 
-	OS = ("Windows", "Darwin")
-
 	for loc in locations:
 		nsslib = os.path.join(loc, nssname)
-		LOG.debug("Loading NSS library from %s", nsslib)
-
-		if SYSTEM in OS:
-			# On windows in order to find DLLs referenced by nss3.dll
-			# we need to have those locations on PATH
-			os.environ["PATH"] = ';'.join([loc, os.environ["PATH"]])
-			LOG.debug("PATH is now %s", os.environ["PATH"])
-			# However this doesn't seem to work on all setups and needs to be
-			# set before starting python so as a workaround we chdir to
-			# Firefox's nss3.dll/libnss3.dylib location
-			if loc:
-				if not os.path.isdir(loc):
-					# No point in trying to load from paths that don't exist
-					continue
 
-				workdir = os.getcwd()
-				os.chdir(loc)
+		if SYSTEM in ("Windows", "Darwin") and loc and not os.path.isdir(loc):
+			# No point in trying to load from paths that don't exist
+			continue
 
 		try:
-			nss: ct.CDLL = ct.CDLL(nsslib)
+			nss: ct.CDLL = open_nss(loc, nssname)
 		except OSError as e:
 			fail_errors.append((nsslib, str(e)))
 		else:
 			LOG.debug("Loaded NSS library from %s", nsslib)
+			if loc:
+				# A bare name is resolved by the system loader and is
+				# found on the first attempt, so only explicit paths are cached
+				save_nss_cache(nsslib)
 			return nss
-		finally:
-			if SYSTEM in OS and loc:
-				# Restore workdir changed above
-				os.chdir(workdir)
 
 	else:
 		LOG.error("Couldn't find or load '%s'. This library is essential "
@@ -257,6 +450,10 @@ def find_nss(locations, nssname) -> ct.CDLL:
 def load_libnss():
 	"""Load libnss into python using the CDLL interface
 	"""
+	nss = load_cached_nss()
+	if nss is not None:
+		return nss
+
 	if SYSTEM == "Windows":
 		nssname = "nss3.dll"
 		if SYS64:
@@ -438,9 +635,9 @@ class NSSProxy:
 				"Couldn't shutdown current NSS profile",
 			)
 
-	def authenticate(self, profile, interactive):
+	def authenticate(self, profile, interactive, password=None):
 		"""Unlocks the profile if necessary, in which case a password
-		will prompted to the user.
+		will prompted to the user unless one was given.
 		"""
 		LOG.debug("Retrieving internal key slot")
 		keyslot = self._PK11_GetInternalKeySlot()
@@ -454,7 +651,8 @@ class NSSProxy:
 
 		try:
 			if self._PK11_NeedLogin(keyslot):
-				password: str = ask_password(profile, interactive)
+				if password is None:
+					password = ask_password(profile, interactive)
 
 				LOG.debug("Authenticating with password '%s'", password)
 				err_status: int = self._PK11_CheckUserPassword(keyslot, password)
@@ -527,56 +725,60 @@ class MozillaInteraction:
 		self.profile = profile
 		self.proxy.initialize(self.profile)
 
-	def authenticate(self, interactive):
+	def authenticate(self, interactive, password=None):
 		"""Authenticate the the current profile is protected by a master password,
-		prompt the user and unlock the profile.
+		prompt the user (unless a password was given) and unlock the profile.
 		"""
-		self.proxy.authenticate(self.profile, interactive)
+		self.proxy.authenticate(self.profile, interactive, password)
 
 	def unload_profile(self):
 		"""Shutdown NSS and deactivate current profile
 		"""
 		self.proxy.shutdown()
 
-	def decrypt_passwords(self) -> PWStore:
+	def decrypt_passwords(self, times: bool = False) -> Iterator[dict[str, str]]:
 		"""Decrypt requested profile using the provided password.
-		Returns all passwords in a list of dicts
+		Yields each password as a dict as soon as it is decoded, with the
+		login's LOGIN_TIME_FIELDS (Unix milliseconds) added if times is set
 		"""
 		credentials: Credentials = self.obtain_credentials()
 
 		LOG.info("Decrypting credentials")
-		outputs: list[dict[str, str]] = []
+		found = False
 
 		url: str
 		user: str
 		passw: str
 		enctype: int
-		for url, user, passw, enctype in credentials:
-			# enctype informs if passwords need to be decrypted
-			if enctype:
-				try:
-					LOG.debug("Decrypting username data '%s'", user)
-					user = self.proxy.decrypt(user)
-					LOG.debug("Decrypting password data '%s'", passw)
-					passw = self.proxy.decrypt(passw)
-				except (TypeError, ValueError) as e:
-					LOG.warning("Failed to decode username or password for entry from URL %s", url)
-					LOG.exception(e)
-					continue
-
-			LOG.debug("Decoded username '%s' and password '%s' for website '%s'", user, passw, url)
-
-			output = {"url": url, "user": user, "password": passw}
-			outputs.append(output)
+		stamps: tuple
+		try:
+			for url, user, passw, enctype, stamps in credentials:
+				# enctype informs if passwords need to be decrypted
+				if enctype:
+					try:
+						LOG.debug("Decrypting username data '%s'", user)
+						user = self.proxy.decrypt(user)
+						LOG.debug("Decrypting password data '%s'", passw)
+						passw = self.proxy.decrypt(passw)
+					except (TypeError, ValueError) as e:
+						LOG.warning("Failed to decode username or password for entry from URL %s", url)
+						LOG.exception(e)
+						continue
+
+				LOG.debug("Decoded username '%s' and password '%s' for website '%s'", user, passw, url)
+
+				found = True
+				login = {"url": url, "user": user, "password": passw}
+				if times:
+					login.update(zip(LOGIN_TIME_FIELDS, stamps))
+				yield login
+		finally:
+			# Close credential handles (SQL)
+			credentials.done()
 
-		if not outputs:
+		if not found:
 			LOG.warning("No passwords found in selected profile")
 
-		# Close credential handles (SQL)
-		credentials.done()
-
-		return outputs
-
 	def obtain_credentials(self) -> Credentials:
 		"""Figure out which of the 2 possible backend credential engines is available
 		"""
@@ -594,6 +796,8 @@ class MozillaInteraction:
 
 
 class OutputFormat:
+	"""pwstore is an iterable of password dicts, consumed once by output()
+	"""
 	def __init__(self, pwstore: PWStore, cmdargs: argparse.Namespace):
 		self.pwstore = pwstore
 		self.cmdargs = cmdargs
@@ -615,7 +819,14 @@ class HumanOutputFormat(OutputFormat):
 
 class JSONOutputFormat(OutputFormat):
 	def output(self):
-		sys.stdout.write(json.dumps(self.pwstore, indent=2))
+		# Written entry by entry, in the same layout as json.dumps(..., indent=2)
+		sys.stdout.write("[")
+		empty = True
+		for output in self.pwstore:
+			sys.stdout.write("\n" if empty else ",\n")
+			sys.stdout.write(indent(json.dumps(output, indent=2), "  "))
+			empty = False
+		sys.stdout.write("]" if empty else "\n]")
 		# Json dumps doesn't add the final newline
 		sys.stdout.write("\n")
 
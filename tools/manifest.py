@@ -0,0 +1,83 @@
+import json
+
+from tools.utils import *
+
+MANIFEST_FILE = '.manifest.json'
+
+# Databases whose size and mtime are recorded for each profile:
+PROFILE_DATABASES = {
+	'chrome': ['History', 'Login Data', 'Cookies'],
+	'mozilla': ['places.sqlite', 'cookies.sqlite', 'logins.json', 'signons.sqlite'],
+}
+# Files next to (or one level above) a browser root that list its profiles:
+PROFILE_LISTS = ['Local State', 'profiles.ini']
+
+
+def get_signature(path):
+	"""
+	Returns [mtime_ns, size] for path, or None if it doesn't exist:
+	"""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return [st.st_mtime_ns, st.st_size]
+
+
+def get_watched_paths(directories: list, profiles: dict, is_profile=False) -> list:
+	"""
+	Everything whose change could alter discovery: the roots and their
+	subdirectories (a directory's mtime changes when entries are added or
+	removed), the profile list files, and each profile's databases.
+	"""
+	watched = []
+	for directory in directories:
+		watched.append(directory)
+		if is_profile:
+			continue
+		watched += scan(directory)[0]
+		for basepath in [directory, os.path.dirname(directory)]:
+			watched += [os.path.join(basepath, name) for name in PROFILE_LISTS]
+	for browser, browser_profiles in profiles.items():
+		for profile in browser_profiles:
+			watched.append(profile)
+			watched += [os.path.join(profile, name) for name in PROFILE_DATABASES[browser]]
+	return list(dict.fromkeys(watched))
+
+
+def read_manifest(loot_dir) -> dict:
+	manifest_file = os.path.join(loot_dir, MANIFEST_FILE)
+	if not os.path.isfile(manifest_file):
+		return {}
+	with open(manifest_file, 'r') as f:
+		try:
+			return json.load(f)
+		except ValueError:
+			warn(f"Ignoring unreadable manifest {manifest_file}")
+			return {}
+
+
+def load_manifest(loot_dir, key: str):
+	"""
+	Returns the cached profiles for a discovery request, or None if there are
+	none or any watched path's mtime or size has changed since they were cached:
+	"""
+	entry = read_manifest(loot_dir).get(key)
+	if not entry:
+		return None
+	for path, signature in entry['watched'].items():
+		if get_signature(path) != signature:
+			return None
+	return entry['profiles']
+
+
+def save_manifest(loot_dir, key: str, directories: list, profiles: dict, is_profile=False):
+	manifest = read_manifest(loot_dir)
+	manifest[key] = {
+		'profiles': profiles,
+		'watched': {path: get_signature(path) for path in get_watched_paths(directories, profiles, is_profile=is_profile)},
+	}
+	manifest_file = os.path.join(loot_dir, MANIFEST_FILE)
+	with open(f"{manifest_file}.tmp", 'w') as f:
+		json.dump(manifest, f, indent=2, sort_keys=True)
+	os.replace(f"{manifest_file}.tmp", manifest_file)
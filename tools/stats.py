@@ -0,0 +1,212 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+from tools.utils import *
+
+STATS_FILE = 'stats.json'
+# Linux files for resetting and reading a process's RSS high-water mark:
+CLEAR_REFS_FILE = '/proc/self/clear_refs'
+STATUS_FILE = '/proc/self/status'
+PROFILE_FILE = 'profile.prof'
+# Functions listed in the report when running under cProfile:
+HOTSPOTS = 25
+
+# Stage records of this process, in the order the stages finished:
+RECORDS = []
+# The loot directory, profile and artifact that new stages are attributed to:
+CONTEXT = {'loot_dir': None, 'profile': None, 'artifact': None}
+
+
+@contextlib.contextmanager
+def scope(**context):
+	"""
+	Attributes every stage started inside the block to the given loot_dir,
+	profile and/or artifact:
+	"""
+	previous = dict(CONTEXT)
+	CONTEXT.update(context)
+	try:
+		yield
+	finally:
+		CONTEXT.update(previous)
+
+
+def start_memory_tracing():
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+
+
+def reset_memory_peak():
+	if hasattr(tracemalloc, 'reset_peak'):
+		tracemalloc.reset_peak()
+	else:
+		# Python < 3.9 can only reset the peak together with the traces:
+		tracemalloc.clear_traces()
+
+
+def reset_rss_peak() -> bool:
+	"""
+	Resets this process's RSS high-water mark, so the next get_rss_peak()
+	covers only what runs after it. ru_maxrss never goes down, so this needs
+	Linux's /proc/self/clear_refs:
+	:return: whether the mark was reset
+	"""
+	try:
+		with open(CLEAR_REFS_FILE, 'w') as f:
+			f.write('5')
+	except OSError:
+		return False
+	return True
+
+
+def get_rss_peak():
+	"""
+	RSS high-water mark (VmHWM) of this process in bytes since the last
+	reset_rss_peak(), or None where it isn't available:
+	"""
+	try:
+		with open(STATUS_FILE, 'r') as f:
+			for line in f:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1]) * 1024
+	except (OSError, ValueError, IndexError):
+		pass
+	return None
+
+
+@contextlib.contextmanager
+def stage(name, memory=False, **counters):
+	"""
+	Times the block with a high-resolution timer and records it as a stage.
+	The block can add to the record's 'rows' and 'bytes' counters (or any
+	other field) through the yielded dict. Stages nest, so an outer stage's
+	time includes the stages inside it.
+	With memory set and tracemalloc tracing (--mem-stats), the record also
+	gets the block's tracemalloc peak and, where the RSS high-water mark can
+	be reset (Linux), the block's own RSS peak (None elsewhere); memory stages
+	must not nest, as each one resets both peaks.
+	"""
+	record = {'stage': name, **CONTEXT, 'seconds': 0.0, 'rows': 0, 'bytes': 0, **counters}
+	memory = memory and tracemalloc.is_tracing()
+	rss_reset = False
+	if memory:
+		reset_memory_peak()
+		rss_reset = reset_rss_peak()
+	start = time.perf_counter()
+	try:
+		yield record
+	finally:
+		record['seconds'] = time.perf_counter() - start
+		if memory:
+			record['tracemalloc_peak'] = tracemalloc.get_traced_memory()[1]
+			record['rss_peak'] = get_rss_peak() if rss_reset else None
+		RECORDS.append(record)
+
+
+def record(name, seconds, **counters):
+	"""
+	Records a stage that was timed elsewhere:
+	"""
+	RECORDS.append({'stage': name, **CONTEXT, 'seconds': seconds, 'rows': 0, 'bytes': 0, **counters})
+
+
+def take() -> list:
+	"""
+	Removes and returns this process's records, for worker processes to hand
+	their stages back to the parent:
+	"""
+	records = RECORDS[:]
+	RECORDS.clear()
+	return records
+
+
+def get_file_size(path) -> int:
+	try:
+		return os.path.getsize(path)
+	except OSError:
+		return 0
+
+
+def summarize(records: list) -> dict:
+	"""
+	Totals per stage, and per stage within each profile and artifact:
+	"""
+	def add(totals, record):
+		total = totals.setdefault(record['stage'], {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+		total['count'] += 1
+		total['seconds'] += record['seconds']
+		total['rows'] += record['rows']
+		total['bytes'] += record['bytes']
+
+	stages = {}
+	profiles = {}
+	for record in records:
+		add(stages, record)
+		if record['profile']:
+			artifacts = profiles.setdefault(record['profile'], {})
+			add(artifacts.setdefault(record['artifact'] or '*', {}), record)
+	return {'stages': stages, 'profiles': profiles}
+
+
+def format_bytes(size) -> str:
+	if size is None:
+		return 'n/a'
+	for unit in ['B', 'KiB', 'MiB', 'GiB']:
+		if size < 1024 or unit == 'GiB':
+			return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+		size /= 1024
+
+
+def get_memory_summary(records: list) -> list:
+	"""
+	Lines summarizing the memory stages, largest tracemalloc peak first:
+	"""
+	exported = {}
+	for record in records:
+		if record['stage'] == 'export':
+			key = (record['profile'], record['artifact'])
+			exported[key] = exported.get(key, 0) + record['rows']
+	lines = []
+	for record in sorted((record for record in records if 'tracemalloc_peak' in record), key=lambda record: record['tracemalloc_peak'], reverse=True):
+		unit = f"{record['profile']} {record['artifact']}" if record['profile'] else record['stage']
+		rows = exported.get((record['profile'], record['artifact']), record['rows'])
+		lines.append(f"{format_bytes(record['tracemalloc_peak']):>11} peak  {format_bytes(record['rss_peak']):>11} RSS  {rows:>10} rows  {unit}")
+	return lines
+
+
+def get_hotspots(profiler, limit=HOTSPOTS) -> list:
+	"""
+	The functions with the most cumulative time in a cProfile run:
+	"""
+	import pstats
+	entries = []
+	for (filename, line, function), (_, calls, total, cumulative, _) in pstats.Stats(profiler).stats.items():
+		entries.append({'function': f"{filename}:{line}({function})", 'calls': calls, 'seconds': total, 'cumulative_seconds': cumulative})
+	entries.sort(key=lambda entry: entry['cumulative_seconds'], reverse=True)
+	return entries[:limit]
+
+
+def write_report(loot_dir, records: list, elapsed: float, profiler=None, **extra) -> str:
+	"""
+	Writes the stages recorded for loot_dir (plus the stages not tied to any
+	loot directory) to a JSON report in loot_dir, along with their totals and,
+	when given a cProfile profiler, its hot spots and raw stats:
+	:return: path of the report
+	"""
+	records = [record for record in records if record['loot_dir'] in (loot_dir, None)]
+	report = {
+		'elapsed_seconds': elapsed,
+		**extra,
+		**summarize(records),
+		'records': records,
+	}
+	if profiler is not None:
+		profile_file = os.path.join(loot_dir, PROFILE_FILE)
+		profiler.dump_stats(profile_file)
+		report['cprofile'] = {'file': profile_file, 'hotspots': get_hotspots(profiler)}
+	stats_file = os.path.join(loot_dir, STATS_FILE)
+	with open(stats_file, 'w') as f:
+		json.dump(report, f, indent=2)
+	return stats_file
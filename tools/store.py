@@ -0,0 +1,164 @@
+import contextlib
+import sqlite3
+from urllib.parse import urlsplit
+
+from tools.utils import *
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS browsers (
+	id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS profiles (
+	id INTEGER PRIMARY KEY,
+	browser_id INTEGER NOT NULL REFERENCES browsers(id),
+	path TEXT NOT NULL,
+	name TEXT,
+	UNIQUE (browser_id, path)
+);
+CREATE TABLE IF NOT EXISTS history (
+	profile_id INTEGER NOT NULL REFERENCES profiles(id),
+	visit_time TEXT,
+	url TEXT,
+	host TEXT
+);
+CREATE TABLE IF NOT EXISTS cookies (
+	profile_id INTEGER NOT NULL REFERENCES profiles(id),
+	host TEXT,
+	name TEXT,
+	value TEXT,
+	path TEXT,
+	expiry TEXT,
+	last_accessed TEXT,
+	creation_time TEXT,
+	is_secure INTEGER,
+	is_httponly INTEGER
+);
+CREATE TABLE IF NOT EXISTS logins (
+	profile_id INTEGER NOT NULL REFERENCES profiles(id),
+	origin_url TEXT,
+	action_url TEXT,
+	username TEXT,
+	date_created TEXT,
+	date_last_used TEXT,
+	host TEXT
+);
+"""
+
+# Created once after the bulk load rather than maintained row by row:
+INDEXES = """
+CREATE INDEX IF NOT EXISTS history_host ON history (host);
+CREATE INDEX IF NOT EXISTS history_url ON history (url);
+CREATE INDEX IF NOT EXISTS history_visit_time ON history (visit_time);
+CREATE INDEX IF NOT EXISTS cookies_host ON cookies (host);
+CREATE INDEX IF NOT EXISTS cookies_expiry ON cookies (expiry);
+CREATE INDEX IF NOT EXISTS logins_host ON logins (host);
+CREATE INDEX IF NOT EXISTS logins_origin_url ON logins (origin_url);
+"""
+
+# Store column -> export column names it can be filled from (first match wins).
+# Timestamps are stored as the exported ISO-8601 UTC strings:
+COLUMNS = {
+	'history': {
+		'visit_time': ['visit_time'],
+		'url': ['url'],
+	},
+	'cookies': {
+		'host': ['host'],
+		'name': ['name'],
+		'value': ['value'],
+		'path': ['path'],
+		'expiry': ['expiry'],
+		'last_accessed': ['last_accessed'],
+		'creation_time': ['creation_time'],
+		'is_secure': ['is_secure'],
+		'is_httponly': ['is_httponly'],
+	},
+	'logins': {
+		'origin_url': ['origin_url', 'url'],
+		'action_url': ['action_url'],
+		'username': ['username_value', 'user'],
+		'date_created': ['date_created'],
+		'date_last_used': ['date_last_used'],
+	},
+}
+
+# Derived host column, filled from the URL column of the same row:
+HOST_SOURCES = {'history': 'url', 'logins': 'origin_url'}
+
+
+def get_host(url):
+	try:
+		return urlsplit(url).hostname
+	except (TypeError, ValueError):
+		return None
+
+
+class Store:
+	"""
+	Consolidated SQLite output database for every extracted artifact.
+	The write lock is only taken for each short write (registering a profile,
+	clearing an artifact, inserting one exported batch), never while source
+	databases are read or export files written, so parallel workers only
+	queue behind each other's inserts; the busy timeout covers that wait.
+	"""
+	def __init__(self, path, timeout=300):
+		self.path = path
+		self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('PRAGMA synchronous=NORMAL')
+		self.conn.executescript(SCHEMA)
+
+	@contextlib.contextmanager
+	def transaction(self):
+		self.conn.execute('BEGIN IMMEDIATE')
+		try:
+			yield
+		except BaseException:
+			self.conn.execute('ROLLBACK')
+			raise
+		self.conn.execute('COMMIT')
+
+	def begin_profile(self, browser, profile) -> int:
+		with self.transaction():
+			self.conn.execute('INSERT OR IGNORE INTO browsers (name) VALUES (?)', (browser,))
+			browser_id = self.conn.execute('SELECT id FROM browsers WHERE name = ?', (browser,)).fetchone()[0]
+			self.conn.execute('INSERT OR IGNORE INTO profiles (browser_id, path, name) VALUES (?, ?, ?)', (browser_id, profile, os.path.basename(profile)))
+			return self.conn.execute('SELECT id FROM profiles WHERE browser_id = ? AND path = ?', (browser_id, profile)).fetchone()[0]
+
+	def clear(self, artifact, profile_id):
+		with self.transaction():
+			self.conn.execute(f'DELETE FROM {artifact} WHERE profile_id = ?', (profile_id,))
+
+	def writer(self, artifact, profile_id):
+		"""
+		Returns a callback taking (headers, rows) that bulk-inserts each
+		exported batch into the artifact's table, one transaction per batch:
+		"""
+		columns = list(COLUMNS[artifact])
+		host_source = HOST_SOURCES.get(artifact)
+		placeholders = ', '.join('?' * (len(columns) + 2 if host_source else len(columns) + 1))
+		host_index = columns.index(host_source) + 1 if host_source else None
+		statement = f"INSERT INTO {artifact} (profile_id, {', '.join(columns)}{', host' if host_source else ''}) VALUES ({placeholders})"
+		positions = []
+
+		def write(headers, rows):
+			if not positions:
+				for column in columns:
+					sources = COLUMNS[artifact][column]
+					positions.append(next((headers.index(source) for source in sources if source in headers), None))
+			records = []
+			for row in rows:
+				record = [profile_id] + [None if position is None else row[position] for position in positions]
+				if host_index:
+					record.append(get_host(record[host_index]))
+				records.append(record)
+			with self.transaction():
+				self.conn.executemany(statement, records)
+		return write
+
+	def create_indexes(self):
+		self.conn.executescript(INDEXES)
+
+	def close(self):
+		self.conn.close()
@@ -0,0 +1,85 @@
+import time
+
+# Browser timestamp epochs:
+WEBKIT = 'webkit'   # Chrome: microseconds since 1601-01-01 UTC
+PRTIME = 'prtime'   # Mozilla: microseconds since 1970-01-01 UTC
+UNIX = 'unix'       # seconds since 1970-01-01 UTC
+UNIX_MS = 'unix_ms' # Mozilla logins: milliseconds since 1970-01-01 UTC
+
+WEBKIT_EPOCH_OFFSET = 11644473600   # seconds between 1601-01-01 and 1970-01-01
+
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Exported ISO-8601 columns, typed as timestamps in columnar output:
+TIMESTAMP_COLUMNS = {'visit_time', 'date_created', 'date_last_used', 'date_password_changed', 'expiry', 'last_accessed', 'creation_time'}
+
+
+def unix_seconds(column: str, epoch: str) -> str:
+	"""
+	SQL expression converting an epoch column to Unix seconds:
+	"""
+	if epoch == WEBKIT:
+		return f"{column}/1000000-{WEBKIT_EPOCH_OFFSET}"
+	if epoch == PRTIME:
+		return f"{column}/1000000"
+	if epoch == UNIX_MS:
+		return f"{column}/1000"
+	return column
+
+
+def unix_usec(column: str, epoch: str) -> str:
+	"""
+	SQL expression converting an epoch column to Unix microseconds, which
+	keeps full precision and orders the same across browsers:
+	"""
+	if epoch == WEBKIT:
+		return f"{column}-{WEBKIT_EPOCH_OFFSET * 1000000}"
+	if epoch == PRTIME:
+		return column
+	if epoch == UNIX_MS:
+		return f"{column}*1000"
+	return f"{column}*1000000"
+
+
+def iso(column: str, epoch: str) -> str:
+	"""
+	SQL expression rendering an epoch column as ISO-8601 UTC, computed by SQLite
+	itself; unset (zero or NULL) timestamps become NULL:
+	"""
+	return f"CASE WHEN {column} > 0 THEN strftime('{ISO_FORMAT}', {unix_seconds(column, epoch)}, 'unixepoch') END"
+
+
+def timestamp_columns(column: str, epoch: str, name: str) -> str:
+	"""
+	SELECT list entry for a timestamp: the ISO-8601 column plus the raw integer:
+	"""
+	return f"{iso(column, epoch)} AS {name}, {column} AS {name}_raw"
+
+
+def to_iso(value, epoch: str):
+	"""
+	Python counterpart of iso() for timestamps read outside SQLite (such as
+	logins.json); unset (zero, null or non-numeric) timestamps become None:
+	"""
+	if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+		return None
+	value = int(value)
+	if epoch == WEBKIT:
+		seconds = value // 1000000 - WEBKIT_EPOCH_OFFSET
+	elif epoch == PRTIME:
+		seconds = value // 1000000
+	elif epoch == UNIX_MS:
+		seconds = value // 1000
+	else:
+		seconds = value
+	try:
+		return time.strftime(ISO_FORMAT, time.gmtime(seconds))
+	except (OverflowError, OSError, ValueError):
+		return None
+
+
+def timestamp_values(value, epoch: str) -> list:
+	"""
+	Python counterpart of timestamp_columns(): the ISO-8601 value plus the raw one:
+	"""
+	return [to_iso(value, epoch), value]
@@ -18,19 +18,36 @@ def warn(msg: str):
 
 
 def ls(path, files=False, directories=False) -> list:
-	paths = [os.path.join(path, f) for f in os.listdir(path) if f]
 	rpaths = []
-	if files:
-		for file in paths:
-			if is_readable_file(file):
-				rpaths.append(file)
-	if directories:
-		for directory in paths:
-			if os.path.isdir(directory):
-				rpaths.append(directory)
+	with os.scandir(path) as entries:
+		for entry in entries:
+			if files and entry.is_file() and os.access(entry.path, os.R_OK):
+				rpaths.append(entry.path)
+			if directories and entry.is_dir():
+				rpaths.append(entry.path)
 	return rpaths
 
 
+def scan(path) -> tuple:
+	"""
+	Lists a directory once with os.scandir, splitting it into subdirectory
+	paths and file names using the type information cached on each DirEntry:
+	:return: tuple (list of subdirectory paths, set of file names)
+	"""
+	subdirs = []
+	filenames = set()
+	try:
+		with os.scandir(path) as entries:
+			for entry in entries:
+				if entry.is_dir():
+					subdirs.append(entry.path)
+				elif entry.is_file():
+					filenames.add(entry.name)
+	except OSError:
+		pass
+	return subdirs, filenames
+
+
 def getfilecount(path) -> int:
 	directory = Path(path)
 	numfiles = len([name for name in os.listdir(directory) if is_readable_file(os.path.join(directory, name))])
@@ -1,59 +1,128 @@
 import getpass
+import json
 import platform
 import struct
+from configparser import ConfigParser, Error as ConfigParserError
 
 from tools.utils import *
 
+try:
+	from functools import cached_property
+except ImportError:
+	class cached_property:
+		"""
+		functools.cached_property for Python < 3.8: the value is worked out on
+		first access and stored on the instance, where it shadows the descriptor.
+		"""
+		def __init__(self, func):
+			self.func = func
+			self.__doc__ = func.__doc__
+
+		def __get__(self, instance, owner=None):
+			if instance is None:
+				return self
+			value = instance.__dict__[self.func.__name__] = self.func(instance)
+			return value
+
+# Files whose presence marks a directory as a browser profile:
+PROFILE_MARKERS = {
+	'History': 'chrome',
+	'places.sqlite': 'mozilla',
+}
+
+
+def is_within(path, root) -> bool:
+	"""
+	Whether path, with symlinks and '..' resolved, is root or lies under it:
+	"""
+	path = os.path.realpath(path)
+	root = os.path.realpath(root)
+	try:
+		return os.path.commonpath([path, root]) == root
+	except ValueError:
+		# Paths on different drives
+		return False
+
 
 class Platform:
-	def __init__(self):
-		self.arch = struct.calcsize("P") * 8
-		self.name = os.name
-		self.platform = platform.system() # Linux, Darwin, or Windows
-		self.release = platform.release()
-		self.arm = None
-		self.python = sys.executable
-
-		if 'CYGWIN' in platform.system():
-			self.platform = 'Windows'
-
-		if self.platform == 'Linux':
-			platform_details = [platform.machine(), platform.platform(), os.uname(), platform.version()]
-			arm64_flags = ['arm64', 'ARM64', 'arm-64', 'ARM-64']
-			if 'arm' in platform_details or 'ARM' in platform_details:
-				for flag in arm64_flags:
-					if flag in platform_details:
-						self.arm = 'arm64'
-						break
-				if not self.arm:
-					self.arm = 'arm'
+	"""
+	Facts about the machine running browserintel, each worked out the first
+	time it is read and cached on the instance from then on.
+	"""
+	@cached_property
+	def arch(self) -> int:
+		return struct.calcsize("P") * 8
+
+	@cached_property
+	def name(self) -> str:
+		return os.name
+
+	@cached_property
+	def platform(self) -> str:
+		system = platform.system() # Linux, Darwin, or Windows
+		if 'CYGWIN' in system:
+			return 'Windows'
+		return system
+
+	@cached_property
+	def release(self) -> str:
+		return platform.release()
+
+	@cached_property
+	def python(self) -> str:
+		return sys.executable
+
+	@cached_property
+	def arm(self):
+		if self.platform != 'Linux':
+			return None
+		platform_details = [platform.machine(), platform.platform(), os.uname(), platform.version()]
+		arm64_flags = ['arm64', 'ARM64', 'arm-64', 'ARM-64']
+		if 'arm' in platform_details or 'ARM' in platform_details:
+			for flag in arm64_flags:
+				if flag in platform_details:
+					return 'arm64'
+			return 'arm'
+		return None
 
 class Info(Platform):
-	def __init__(self):
-		super().__init__()
+	@cached_property
+	def username(self) -> str:
+		if self.platform == 'Windows':
+			return os.getenv('USERNAME')
+		return getpass.getuser()
+
+	@cached_property
+	def username_alt(self) -> str:
+		import pwd
+		return pwd.getpwuid(os.getuid()).pw_name
 
+	@cached_property
+	def uid(self) -> int:
 		if self.platform == 'Windows':
-			self.username = os.getenv('USERNAME')
-			self.uid = 0
-		else:
-			self.uid = os.getuid()
-			import pwd
-			self.username = getpass.getuser()
-			self.username_alt = pwd.getpwuid(os.getuid()).pw_name
+			return 0
+		return os.getuid()
 
-		self.home = self.get_user_home_dir()
-		self.appdata = self.get_appdata_dir()
+	@cached_property
+	def home(self) -> str:
+		return self.get_user_home_dir()
 
-	def get_user_home_dir(self, user=None):
+	@cached_property
+	def appdata(self) -> str:
+		return self.get_appdata_dir()
+
+	def get_user_home_dir(self, user=None, platform=None):
 		if not user:
 			user = self.username
-		if self.platform == 'Linux':
+		if not platform:
+			platform = self.platform
+		if platform == 'Linux':
 			if user == 'root':
 				return '/root'
 			return f"/home/{user}"
-		elif self.platform == 'Darwin':
+		elif platform == 'Darwin':
 			return f"/Users/{user}"
-		elif self.platform == 'Windows':
+		elif platform == 'Windows':
 			return f"C:/Users/{user}"
 		return None
 
@@ -78,17 +147,126 @@ class Info(Platform):
 			return f"/home/{user}/.config"
 		return None
 
-	def get_most_likely_subdir(self, directory=None, directories=None) -> str:
+	@staticmethod
+	def classify(filenames) -> set:
+		return {browser for marker, browser in PROFILE_MARKERS.items() if marker in filenames}
+
+	def scan_browser_root(self, directory) -> dict:
+		"""
+		Walks a browser root once, classifying the root and each of its
+		subdirectories from a single scandir() of every directory:
+		:return: dict {path: (number of subdirectories, set of browsers whose profile markers it holds)}
+		"""
+		subdirs, filenames = scan(directory)
+		scanned = {directory: (len(subdirs), self.classify(filenames))}
+		for subdir in subdirs:
+			children, filenames = scan(subdir)
+			scanned[subdir] = (len(children), self.classify(filenames))
+		return scanned
+
+	@staticmethod
+	def get_listed_profiles(directory, evidence=False) -> list:
+		"""
+		Returns the profile directories a browser root lists itself: Chrome's
+		'Local State' profile cache and Firefox's profiles.ini (which lives in
+		the root or, for '.../Profiles' roots, in its parent). On evidence,
+		absolute profiles.ini paths point into the original machine, so they
+		are rebased onto the profile directory of the same name next to
+		profiles.ini, or skipped if there is none; any listed path that
+		resolves outside the directory of its list is skipped as well:
+		"""
+		listed = []
+		local_state = os.path.join(directory, 'Local State')
+		if os.path.isfile(local_state):
+			try:
+				with open(local_state, 'r', encoding='utf-8') as f:
+					info_cache = json.load(f)['profile']['info_cache']
+				for name in info_cache:
+					path = os.path.join(directory, name)
+					if evidence and not is_within(path, directory):
+						warn(f"Skipping profile {name} listed in {local_state}: it resolves outside {directory}")
+						continue
+					listed.append(path)
+			except (OSError, ValueError, KeyError, TypeError):
+				warn(f"Can't read profile list from {local_state}")
+		for basepath in [directory, os.path.dirname(directory)]:
+			profiles_ini = os.path.join(basepath, 'profiles.ini')
+			if not os.path.isfile(profiles_ini):
+				continue
+			profiles = ConfigParser()
+			try:
+				profiles.read(profiles_ini, encoding='utf-8')
+			except ConfigParserError:
+				warn(f"Can't read profile list from {profiles_ini}")
+				break
+			for section in profiles.sections():
+				if not section.startswith('Profile') or not profiles.has_option(section, 'Path'):
+					continue
+				path = profiles.get(section, 'Path')
+				if profiles.get(section, 'IsRelative', fallback='1') == '1':
+					path = os.path.join(basepath, path)
+				elif evidence:
+					# Windows paths too, whatever platform is reading the evidence:
+					name = path.replace('\\', '/').rstrip('/').split('/')[-1]
+					rebased = os.path.join(basepath, name)
+					if not name or not os.path.isdir(rebased):
+						warn(f"Skipping absolute profile path {path} listed in {profiles_ini}: it isn't on the evidence")
+						continue
+					warn(f"Rebased absolute profile path {path} listed in {profiles_ini} onto {rebased}")
+					path = rebased
+				if evidence and not is_within(path, basepath):
+					warn(f"Skipping profile path {path} listed in {profiles_ini}: it resolves outside {basepath}")
+					continue
+				listed.append(path)
+			break
+		return listed
+
+	def find_profiles(self, directory, evidence=False) -> list:
+		"""
+		Finds every profile of a browser root: the root itself and each of its
+		subdirectories holding profile markers, plus any profile listed in the
+		root's 'Local State' or profiles.ini (see get_listed_profiles()). On
+		evidence, subdirectories that are symlinks out of the root are skipped:
+		:return: list of (profile path, set of browsers)
+		"""
+		directory = os.path.normpath(directory)
+		scanned = self.scan_browser_root(directory)
+		subdirs = sorted(path for path in scanned if path != directory)
+		if evidence:
+			for path in [path for path in subdirs if not is_within(path, directory)]:
+				warn(f"Skipping {path}: it resolves outside {directory}")
+				subdirs.remove(path)
+		candidates = [directory] + subdirs
+		candidates += self.get_listed_profiles(directory, evidence=evidence)
+		profiles = []
+		seen = set()
+		for path in candidates:
+			path = os.path.normpath(path)
+			if path in seen:
+				continue
+			seen.add(path)
+			if path in scanned:
+				browsers = scanned[path][1]
+			else:
+				browsers = self.classify(scan(path)[1])
+			if browsers:
+				profiles.append((path, browsers))
+		return profiles
+
+	def get_most_likely_subdir(self, directory=None, directories=None, scanned=None) -> str:
 		if directory:
-			directories = ls(directory, directories=True)
-			target_dir = self.get_most_likely_subdir(directories=directories)
-			return target_dir
+			scanned = self.scan_browser_root(directory)
+			directories = [path for path in scanned if path != directory]
+		target_dir = None
 		prev = 0
 		for directory in directories:
-			numfiles = len(ls(directory, directories=True))
-			if not numfiles > prev:
+			if scanned and directory in scanned:
+				numdirs = scanned[directory][0]
+			else:
+				numdirs = len(scan(directory)[0])
+			if not numdirs > prev:
 				continue
-			prev = numfiles
+			prev = numdirs
 			target_dir = directory
 		return target_dir
 
@@ -101,7 +279,7 @@ class Info(Platform):
 				existing_paths.append(path)
 		return existing_paths
 
-	def get_profiles(self, directories=None, is_profile=None, automatic=False, chrome=False, mozilla=False, most_likely=False, getlist=False):
+	def get_profiles(self, directories=None, is_profile=None, automatic=False, chrome=False, mozilla=False, most_likely=False, getlist=False, evidence=False):
 		if automatic:
 			directories = self.get_browser(listbrowsers=True)
 		if most_likely:
@@ -113,17 +291,18 @@ class Info(Platform):
 		directories = [directory for directory in directories if directory]
 		for directory in directories:
 			if is_profile:
-				profile = directory
+				found = [(directory, self.classify(scan(directory)[1]))]
 			else:
-				profile = self.get_most_likely_subdir(directory)
-			# Check if chrome:
-			if os.path.isfile(f"{profile}/History"):
-				chrome_profiles.append(profile)
-				profile_list.append(profile)
-			# Check if mozilla:
-			if os.path.isfile(f"{profile}/places.sqlite"):
-				mozilla_profiles.append(profile)
-				profile_list.append(profile)
+				found = self.find_profiles(directory, evidence=evidence)
+			for profile, browsers in found:
+				# Check if chrome:
+				if 'chrome' in browsers and profile not in chrome_profiles:
+					chrome_profiles.append(profile)
+					profile_list.append(profile)
+				# Check if mozilla:
+				if 'mozilla' in browsers and profile not in mozilla_profiles:
+					mozilla_profiles.append(profile)
+					profile_list.append(profile)
 		if getlist:
 			return profile_list         # list
 		if chrome and not mozilla:
@@ -136,15 +315,23 @@ class Info(Platform):
 		profiles['mozilla'] = mozilla_profiles
 		return profiles                 # dict
 
-	def get_browser(self, platform=None, user=None, browser_name=None, listbrowsers=False, getprofile=False, most_likely=False):
+	def get_browser(self, platform=None, user=None, home=None, browser_name=None, listbrowsers=False, getprofile=False, most_likely=False):
+		"""
+		Builds the default browser directories for a platform layout, under the
+		given home directory (e.g. a collected home on an evidence mount) or
+		else under the user's home on this machine.
+		"""
 		if not platform:
 			platform = self.platform
 		if not user:
 			user = self.username
+		live = not home
+		if live:
+			home = self.get_user_home_dir(user, platform=platform)
 		if platform == 'Windows':
 			if not browser_name:
-				roaming = f"C:/Users/{user}/AppData/Roaming"
-				local_appdata = f"C:/Users/{user}/AppData/Local"
+				roaming = f"{home}/AppData/Roaming"
+				local_appdata = f"{home}/AppData/Local"
 				default_chrome_dir = f"{local_appdata}/Google/Chrome/User Data"
 				default_chromebeta_dir = f"{local_appdata}/Google/Chrome Beta/User Data"
 				default_chromecanary_dir = f"{local_appdata}/Google/Chrome SxS/User Data"
@@ -155,7 +342,7 @@ class Info(Platform):
 				default_waterfox_dir = f"{roaming}/Waterfox/Profiles"
 		elif platform == 'Darwin':
 			if not browser_name:
-				application_support = f"/Users/{user}/Library/Application Support"
+				application_support = f"{home}/Library/Application Support"
 				default_chrome_dir = f"{application_support}/Google/Chrome"
 				default_chromebeta_dir = f"{application_support}/Google/Chrome Beta"
 				default_chromedev_dir = None
@@ -166,20 +353,22 @@ class Info(Platform):
 				default_waterfox_dir = f"{application_support}/Waterfox/Profiles"
 		elif platform == 'Linux':
 			if not browser_name:
-				if os.getenv('CHROME_CONFIG_HOME'):
+				# The environment only describes this machine, not a collected home:
+				if live and os.getenv('CHROME_CONFIG_HOME'):
 					config_dir = os.getenv('CHROME_CONFIG_HOME')
-				elif os.getenv('XDG_CONFIG_HOME'):
+				elif live and os.getenv('XDG_CONFIG_HOME'):
 					config_dir = os.getenv('XDG_CONFIG_HOME')
 				else:
-					config_dir = f"/home/{user}/.config"
+					config_dir = f"{home}/.config"
 				default_chrome_dir = f"{config_dir}/google-chrome"
 				default_chromebeta_dir = f"{config_dir}/google-chrome-beta"
 				default_chromecanary_dir = None
 				default_chromedev_dir = f"{config_dir}/google-chrome-unstable"
 				default_chromium_dir = f"{config_dir}/chromium"
-				default_firefox_dir = f"/home/{user}/.mozilla/firefox/Profiles"
-				default_palemoon_dir = f"/home/{user}/.moonchild production/pale moon/Profiles"
-				default_waterfox_dir = f"/home/{user}/.waterfox/Profiles"
+				# Linux Mozilla profiles sit next to profiles.ini, without a 'Profiles' subdirectory:
+				default_firefox_dir = f"{home}/.mozilla/firefox"
+				default_palemoon_dir = f"{home}/.moonchild production/pale moon"
+				default_waterfox_dir = f"{home}/.waterfox"
 		else:
 			return None
 		directories = [